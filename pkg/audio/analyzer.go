@@ -21,7 +21,8 @@ type AudioAnalysis struct {
 	VocalSegmentCount int            `json:"vocal_segment_count"`
 	SpectralCentroid  float64        `json:"spectral_centroid"`
 	ZeroCrossingRate  float64        `json:"zero_crossing_rate"`
-	SampleRate        int            `json:"sample_rate"`
+	SampleRate        int            `json:"sample_rate"`      // Rate the analysis ran at
+	FileSampleRate    int            `json:"file_sample_rate"` // Native rate of the audio file
 	Success           bool           `json:"success"`
 	Error             string         `json:"error,omitempty"`
 	ErrorType         string         `json:"error_type,omitempty"`
@@ -3,9 +3,13 @@
 Audio Analysis Service for Track Studio
 Analyzes audio files for BPM, key, duration, and vocal timing using librosa
 """
+import os
 import sys
 import json
+import functools
+import multiprocessing
 import warnings
+from concurrent.futures import ProcessPoolExecutor
 import librosa
 import numpy as np
 from typing import Dict, List, Tuple
@@ -13,36 +17,98 @@ from typing import Dict, List, Tuple
 # Suppress warnings
 warnings.filterwarnings('ignore')
 
+# madmom's RNN + DBN beat tracker is faster and more accurate than librosa's
+# dynamic-programming tracker; use it when installed
+try:
+    from madmom.features.beats import RNNBeatProcessor, DBNBeatTrackingProcessor
+    MADMOM_AVAILABLE = True
+except ImportError:
+    MADMOM_AVAILABLE = False
+
+# Limits BLAS threads in batch workers so N processes don't oversubscribe cores
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+_worker_thread_limits = None
+
+# orjson serializes NumPy arrays natively and is much faster than stdlib json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# The GPU STFT is opt-in (ANALYZER_GPU_STFT=1): importing torch and creating a
+# CUDA context costs more than the STFT saves on a single song
+_USE_GPU = os.environ.get('ANALYZER_GPU_STFT') == '1'
+
+# BPM, key and genre heuristics don't depend on content above ~11 kHz, so
+# analyze at a fixed rate instead of the file's native rate
+ANALYSIS_SAMPLE_RATE = 22050
+
+N_FFT = 2048
+HOP_LENGTH = 512
+
+
+# Key profiles (Krumhansl-Schmuckler key-finding algorithm)
+MAJOR_PROFILE = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
+MINOR_PROFILE = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
+
+KEY_NAMES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+
+
+def _normalized_key_matrix(profile: np.ndarray) -> np.ndarray:
+    """Stack all 12 rotations of a key profile, centered and scaled to unit norm"""
+    rotations = np.stack([np.roll(profile, i) for i in range(12)])
+    rotations = rotations - rotations.mean(axis=1, keepdims=True)
+    rotations = rotations / np.linalg.norm(rotations, axis=1, keepdims=True)
+    return rotations.astype(np.float32)
+
+
+# Precomputed so that Pearson correlation against all keys is a single matmul
+MAJOR_KEYS = _normalized_key_matrix(MAJOR_PROFILE)
+MINOR_KEYS = _normalized_key_matrix(MINOR_PROFILE)
+
+
+def _json_default(obj):
+    """Convert NumPy values for the stdlib json fallback"""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def to_json(data: Dict, indent: bool = False) -> str:
+    """Serialize analysis results (which may contain NumPy arrays) to JSON"""
+    if orjson is not None:
+        option = orjson.OPT_SERIALIZE_NUMPY | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(data, option=option).decode()
+    return json.dumps(data, indent=2 if indent else None, default=_json_default)
+
 
 def estimate_key(chroma: np.ndarray) -> str:
     """Estimate musical key from chroma features"""
-    # Key profiles (Krumhansl-Schmuckler key-finding algorithm)
-    major_profile = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
-    minor_profile = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
-    
-    key_names = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+    # Average chroma over time, centered and normalized
+    chroma_mean = np.mean(chroma, axis=1, dtype=np.float32)
+    chroma_mean = chroma_mean - chroma_mean.mean()
+    norm = np.linalg.norm(chroma_mean)
+    if norm > 0:
+        chroma_mean = chroma_mean / norm
     
-    # Average chroma over time
-    chroma_mean = np.mean(chroma, axis=1)
-    
-    # Correlate with key profiles
-    major_correlations = []
-    minor_correlations = []
-    
-    for i in range(12):
-        major_correlations.append(np.corrcoef(np.roll(major_profile, i), chroma_mean)[0, 1])
-        minor_correlations.append(np.corrcoef(np.roll(minor_profile, i), chroma_mean)[0, 1])
+    # Correlate with every rotation of the key profiles at once
+    major_correlations = MAJOR_KEYS @ chroma_mean
+    minor_correlations = MINOR_KEYS @ chroma_mean
     
     # Find best match
-    max_major = max(major_correlations)
-    max_minor = max(minor_correlations)
+    major_idx = int(np.argmax(major_correlations))
+    minor_idx = int(np.argmax(minor_correlations))
     
-    if max_major > max_minor:
-        key_idx = major_correlations.index(max_major)
-        return f"{key_names[key_idx]} Major"
+    if major_correlations[major_idx] > minor_correlations[minor_idx]:
+        return f"{KEY_NAMES[major_idx]} Major"
     else:
-        key_idx = minor_correlations.index(max_minor)
-        return f"{key_names[key_idx]} Minor"
+        return f"{KEY_NAMES[minor_idx]} Minor"
 
 
 def get_tempo_description(bpm: float) -> str:
@@ -63,15 +129,21 @@ def get_tempo_description(bpm: float) -> str:
         return "Extremely Fast"
 
 
-def estimate_genre(y: np.ndarray, sr: int, tempo: float, spectral_centroid: float, 
+def estimate_genre(S: np.ndarray, sr: int, tempo: float, spectral_centroid: float,
                    zero_crossing_rate: float) -> str:
     """
     Estimate musical genre based on audio features
     Uses tempo, spectral characteristics, and rhythmic patterns
+    Spectral rolloff and bandwidth are only computed (from the magnitude
+    spectrogram S) if a rule actually needs them
     """
-    # Calculate additional features for genre classification
-    spectral_rolloff = np.mean(librosa.feature.spectral_rolloff(y=y, sr=sr))
-    spectral_bandwidth = np.mean(librosa.feature.spectral_bandwidth(y=y, sr=sr))
+    @functools.cache
+    def spectral_rolloff() -> float:
+        return float(np.mean(librosa.feature.spectral_rolloff(S=S, sr=sr)))
+    
+    @functools.cache
+    def spectral_bandwidth() -> float:
+        return float(np.mean(librosa.feature.spectral_bandwidth(S=S, sr=sr)))
     
     # Normalize features for comparison
     tempo_norm = tempo / 180.0  # Normalize to typical max BPM
@@ -81,13 +153,13 @@ def estimate_genre(y: np.ndarray, sr: int, tempo: float, spectral_centroid: floa
     # Genre classification heuristics based on audio characteristics
     
     # Electronic/Dance: High tempo, high spectral content, regular rhythm
-    if tempo > 120 and spectral_centroid > 2500 and spectral_bandwidth > 1800:
+    if tempo > 120 and spectral_centroid > 2500 and spectral_bandwidth() > 1800:
         if tempo > 140:
             return "Electronic"
         return "Dance"
     
     # Rock/Metal: High zero-crossing rate, high spectral rolloff, moderate-high tempo
-    if zero_crossing_rate > 0.1 and spectral_rolloff > 4000:
+    if zero_crossing_rate > 0.1 and spectral_rolloff() > 4000:
         if tempo > 140 and spectral_centroid > 3000:
             return "Metal"
         return "Rock"
@@ -101,11 +173,11 @@ def estimate_genre(y: np.ndarray, sr: int, tempo: float, spectral_centroid: floa
         return "R&B"
     
     # Jazz: Variable tempo, high spectral complexity
-    if spectral_bandwidth > 2000 and 100 <= tempo <= 140:
+    if 100 <= tempo <= 140 and spectral_bandwidth() > 2000:
         return "Jazz"
     
     # Classical: Wide dynamic range, complex spectral content
-    if spectral_bandwidth > 2200 and tempo < 140:
+    if tempo < 140 and spectral_bandwidth() > 2200:
         return "Classical"
     
     # Country: Moderate tempo, characteristic spectral profile
@@ -137,6 +209,57 @@ def estimate_genre(y: np.ndarray, sr: int, tempo: float, spectral_centroid: floa
         return "Alternative"
 
 
+@functools.cache
+def _cuda_torch():
+    """Import torch on first use and return it if CUDA is available, else None"""
+    try:
+        import torch
+    except ImportError:
+        return None
+    return torch if torch.cuda.is_available() else None
+
+
+def compute_spectrogram(y: np.ndarray) -> np.ndarray:
+    """
+    Compute the magnitude STFT shared by chroma and spectral features
+    Matches librosa.stft defaults (centered, zero-padded, periodic Hann window)
+    """
+    torch = _cuda_torch() if _USE_GPU else None
+    if torch is not None:
+        signal = torch.from_numpy(np.ascontiguousarray(y)).to('cuda')
+        window = torch.hann_window(N_FFT, device='cuda', dtype=signal.dtype)
+        stft = torch.stft(signal, n_fft=N_FFT, hop_length=HOP_LENGTH, window=window,
+                          center=True, pad_mode='constant', return_complex=True)
+        return stft.abs().cpu().numpy()
+    
+    return np.abs(librosa.stft(y, n_fft=N_FFT, hop_length=HOP_LENGTH))
+
+
+@functools.cache
+def _beat_processors():
+    """madmom's RNN beat activation networks and DBN tracker, built once per process"""
+    return RNNBeatProcessor(), DBNBeatTrackingProcessor(fps=100)
+
+
+def track_beats(file_path: str, y: np.ndarray, sr: int) -> Tuple[float, np.ndarray]:
+    """
+    Estimate tempo (BPM) and beat times in seconds
+    Uses madmom when available, otherwise librosa with a precomputed onset envelope
+    """
+    if MADMOM_AVAILABLE:
+        rnn, dbn = _beat_processors()
+        activations = rnn(file_path)
+        beat_times = dbn(activations)
+        if len(beat_times) > 1:
+            tempo = 60.0 / float(np.median(np.diff(beat_times)))
+            return tempo, np.asarray(beat_times)
+    
+    onset_env = librosa.onset.onset_strength(y=y, sr=sr)
+    tempo, beat_frames = librosa.beat.beat_track(onset_envelope=onset_env, sr=sr)
+    beat_times = librosa.frames_to_time(beat_frames, sr=sr)
+    return float(np.atleast_1d(tempo)[0]), beat_times
+
+
 def detect_vocal_segments(y: np.ndarray, sr: int, beat_times: np.ndarray) -> List[Dict]:
     """
     Detect vocal segments using RMS energy analysis
@@ -145,7 +268,12 @@ def detect_vocal_segments(y: np.ndarray, sr: int, beat_times: np.ndarray) -> Lis
     # Compute RMS energy in short windows
     hop_length = 512
     frame_length = 2048
-    rms = librosa.feature.rms(y=y, frame_length=frame_length, hop_length=hop_length)[0]
+    
+    # Centered framing as in librosa.feature.rms; the sliding window is a zero-copy
+    # view and einsum sums squares without materializing the overlapping frames
+    y_padded = np.pad(y.astype(np.float32, copy=False), frame_length // 2)
+    frames = np.lib.stride_tricks.sliding_window_view(y_padded, frame_length)[::hop_length]
+    rms = np.sqrt(np.einsum('ij,ij->i', frames, frames) / np.float32(frame_length))
     
     # Convert frames to time
     times = librosa.frames_to_time(np.arange(len(rms)), sr=sr, hop_length=hop_length)
@@ -156,35 +284,26 @@ def detect_vocal_segments(y: np.ndarray, sr: int, beat_times: np.ndarray) -> Lis
     # Find segments where energy exceeds threshold
     is_vocal = rms > threshold
     
-    # Group consecutive frames into segments
-    segments = []
-    in_segment = False
-    start_time = 0
-    
-    for i, (time, vocal) in enumerate(zip(times, is_vocal)):
-        if vocal and not in_segment:
-            # Start new segment
-            start_time = time
-            in_segment = True
-        elif not vocal and in_segment:
-            # End segment (if long enough)
-            if time - start_time > 0.5:  # Minimum 0.5 second segment
-                segments.append({
-                    'start': float(start_time),
-                    'end': float(time),
-                    'duration': float(time - start_time)
-                })
-            in_segment = False
-    
-    # Close final segment if still open
-    if in_segment:
-        segments.append({
-            'start': float(start_time),
-            'end': float(times[-1]),
-            'duration': float(times[-1] - start_time)
-        })
-    
-    return segments
+    # Group consecutive frames into segments via rising/falling edges
+    edges = np.diff(np.concatenate(([0], is_vocal.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    
+    # A segment still open at the last frame closes at the final timestamp
+    is_open = ends == len(times)
+    start_times = times[starts]
+    end_times = times[np.minimum(ends, len(times) - 1)]
+    durations = end_times - start_times
+    
+    # Minimum 0.5 second segment (the trailing open segment is always kept)
+    keep = (durations > 0.5) | is_open
+    
+    return [
+        {'start': start, 'end': end, 'duration': duration}
+        for start, end, duration in zip(start_times[keep].tolist(),
+                                        end_times[keep].tolist(),
+                                        durations[keep].tolist())
+    ]
 
 
 def analyze_audio(file_path: str) -> Dict:
@@ -198,44 +317,51 @@ def analyze_audio(file_path: str) -> Dict:
         Dictionary with analysis results
     """
     try:
-        # Load audio
-        y, sr = librosa.load(file_path, sr=None)
+        # Load audio, downmixed and resampled to the analysis rate
+        file_sample_rate = librosa.get_samplerate(file_path)
+        y, sr = librosa.load(file_path, sr=ANALYSIS_SAMPLE_RATE, mono=True, res_type='soxr_hq')
+        
+        # Keep every feature pass in float32 to halve memory bandwidth
+        y = np.ascontiguousarray(y, dtype=np.float32)
         
         # Duration
-        duration = librosa.get_duration(y=y, sr=sr)
+        duration = len(y) / sr
         
         # Tempo (BPM) and beat tracking
-        tempo, beat_frames = librosa.beat.beat_track(y=y, sr=sr)
-        beat_times = librosa.frames_to_time(beat_frames, sr=sr)
+        tempo, beat_times = track_beats(file_path, y, sr)
+        
+        # Single magnitude STFT shared by chroma and all spectral features
+        S = compute_spectrogram(y)
         
         # Key detection using chroma features
-        chroma = librosa.feature.chroma_cqt(y=y, sr=sr)
+        chroma = librosa.feature.chroma_stft(S=S**2, sr=sr)
         key = estimate_key(chroma)
         
         # Detect vocal segments
         vocal_segments = detect_vocal_segments(y, sr, beat_times)
         
         # Calculate additional metrics
-        spectral_centroid = float(np.mean(librosa.feature.spectral_centroid(y=y, sr=sr)))
+        spectral_centroid = float(np.mean(librosa.feature.spectral_centroid(S=S, sr=sr)))
         zero_crossing_rate = float(np.mean(librosa.feature.zero_crossing_rate(y)))
         
         # Estimate genre based on audio characteristics
-        genre = estimate_genre(y, sr, tempo, spectral_centroid, zero_crossing_rate)
+        genre = estimate_genre(S, sr, tempo, spectral_centroid, zero_crossing_rate)
         
         # Output as JSON
         result = {
-            'duration_seconds': float(duration),
-            'bpm': float(tempo),
+            'duration_seconds': duration,
+            'bpm': tempo,
             'key': key,
             'tempo': get_tempo_description(tempo),
             'genre': genre,
-            'beat_times': [float(t) for t in beat_times.tolist()],
+            'beat_times': beat_times,
             'beat_count': len(beat_times),
             'vocal_segments': vocal_segments,
             'vocal_segment_count': len(vocal_segments),
             'spectral_centroid': spectral_centroid,
             'zero_crossing_rate': zero_crossing_rate,
             'sample_rate': sr,
+            'file_sample_rate': file_sample_rate,
             'success': True
         }
         
@@ -249,12 +375,43 @@ def analyze_audio(file_path: str) -> Dict:
         }
 
 
+def _init_batch_worker():
+    """Pin each batch worker to a single BLAS thread and keep it on the CPU"""
+    global _worker_thread_limits, _USE_GPU
+    # One CUDA context per worker would waste GPU memory; the pool already
+    # keeps every core busy
+    _USE_GPU = False
+    if threadpool_limits is not None:
+        _worker_thread_limits = threadpool_limits(limits=1)
+
+
+def analyze_batch(paths: List[str]) -> bool:
+    """
+    Analyze many files across a process pool, printing one JSON result per line
+    Results are printed in input order; returns True if every file succeeded
+    """
+    all_success = True
+    # Spawned rather than forked so workers never inherit CUDA state from this process
+    with ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=_init_batch_worker,
+                             mp_context=multiprocessing.get_context('spawn')) as executor:
+        for path, result in zip(paths, executor.map(analyze_audio, paths, chunksize=4)):
+            all_success = all_success and result.get('success', False)
+            print(to_json({'file_path': path, **result}), flush=True)
+    return all_success
+
+
 def main():
     """Command-line interface"""
+    if len(sys.argv) == 3 and sys.argv[1] == '--batch':
+        # File containing one audio path per line
+        with open(sys.argv[2], 'r', encoding='utf-8') as f:
+            paths = [line.strip() for line in f if line.strip()]
+        sys.exit(0 if analyze_batch(paths) else 1)
+    
     if len(sys.argv) != 2:
-        print(json.dumps({
+        print(to_json({
             'success': False,
-            'error': 'Usage: python analyzer.py <audio_file_path>'
+            'error': 'Usage: python analyzer.py <audio_file_path> | --batch <paths_file>'
         }))
         sys.exit(1)
     
@@ -262,7 +419,7 @@ def main():
     result = analyze_audio(file_path)
     
     # Output JSON
-    print(json.dumps(result, indent=2))
+    print(to_json(result, indent=True))
     
     # Exit with appropriate code
     sys.exit(0 if result.get('success', False) else 1)
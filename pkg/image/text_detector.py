@@ -7,9 +7,50 @@ Uses OCR to detect any text/characters in generated images
 import sys
 import os
 from PIL import Image
-import pytesseract
+import numpy as np
 import re
 
+# RapidOCR runs in-process, so its model loads once per interpreter instead of
+# spawning a Tesseract subprocess per image. Fall back to Tesseract if missing.
+try:
+    from rapidocr_onnxruntime import RapidOCR
+    RAPIDOCR_AVAILABLE = True
+except ImportError:
+    import pytesseract
+    RAPIDOCR_AVAILABLE = False
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+
+# Larger images are downscaled before OCR; text worth rejecting an image
+# for is still legible at this size and OCR time scales with pixel count
+MAX_OCR_DIMENSION = 1600
+
+# At least two consecutive alphanumerics, to filter out stray symbols
+_ALNUM2 = re.compile(r'[a-zA-Z0-9]{2,}')
+
+_ocr = None
+
+def get_ocr():
+    """Lazily create the shared RapidOCR engine"""
+    global _ocr
+    if _ocr is None:
+        _ocr = RapidOCR()
+    return _ocr
+
+def run_ocr(img):
+    """
+    Run OCR on a PIL image
+    
+    Returns:
+        list of (text, confidence) tuples with confidence on a 0-100 scale
+    """
+    if RAPIDOCR_AVAILABLE:
+        result, _ = get_ocr()(np.array(img))
+        return [(text, round(score * 100, 1)) for _, text, score in (result or [])]
+    
+    data = pytesseract.image_to_data(img, output_type=pytesseract.Output.DICT)
+    return list(zip(data['text'], data['conf']))
+
 def detect_text_in_image(image_path, confidence_threshold=30):
     """
     Detect text in an image using OCR
@@ -25,23 +66,26 @@ def detect_text_in_image(image_path, confidence_threshold=30):
         if not os.path.exists(image_path):
             return {"error": f"Image not found: {image_path}"}
         
-        # Open image
+        # Open image, bound its size and drop to a single grayscale channel
         img = Image.open(image_path)
+        img.thumbnail((MAX_OCR_DIMENSION, MAX_OCR_DIMENSION), Image.LANCZOS)
+        img = img.convert('L')
         
         # Run OCR with detailed data
-        data = pytesseract.image_to_data(img, output_type=pytesseract.Output.DICT)
+        detections = run_ocr(img)
         
         detected_texts = []
         text_count = 0
         
         # Check each detected text element
-        for i, conf in enumerate(data['conf']):
-            if int(conf) > confidence_threshold:
-                text = data['text'][i].strip()
-                # Filter out single characters and common false positives
-                if len(text) > 1 and re.search(r'[a-zA-Z0-9]{2,}', text):
-                    detected_texts.append(f"{text} (conf: {conf})")
-                    text_count += 1
+        for text, conf in detections:
+            if int(float(conf)) <= confidence_threshold:
+                continue
+            text = text.strip()
+            # Filter out single characters and common false positives
+            if len(text) > 1 and _ALNUM2.search(text):
+                detected_texts.append(f"{text} (conf: {conf})")
+                text_count += 1
         
         has_text = text_count > 0
         
@@ -55,24 +99,64 @@ def detect_text_in_image(image_path, confidence_threshold=30):
     except Exception as e:
         return {"error": str(e)}
 
+def detect_text_in_directory(directory, confidence_threshold=30):
+    """
+    Detect text in every image in a directory, reusing one OCR engine
+    
+    Returns:
+        list of result dicts as returned by detect_text_in_image
+    """
+    results = []
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            path = os.path.join(directory, name)
+            result = detect_text_in_image(path, confidence_threshold)
+            result.setdefault("image_path", path)
+            results.append(result)
+    return results
+
+def format_result(result):
+    """Format a result in the simple line format parsed by Go"""
+    if "error" in result:
+        return f"ERROR: {result['error']}"
+    if result['has_text']:
+        return f"TEXT_DETECTED:{result['text_count']}:{result['detected_text']}"
+    return "NO_TEXT_DETECTED"
+
 if __name__ == "__main__":
     if len(sys.argv) < 2:
         print("Usage: python3 text_detector.py <image_path> [confidence_threshold]")
+        print("       python3 text_detector.py --batch <image_dir> [confidence_threshold]")
         sys.exit(1)
     
+    if sys.argv[1] == "--batch":
+        if len(sys.argv) < 3:
+            print("Usage: python3 text_detector.py --batch <image_dir> [confidence_threshold]")
+            sys.exit(1)
+        
+        confidence = int(sys.argv[3]) if len(sys.argv) > 3 else 30
+        results = detect_text_in_directory(sys.argv[2], confidence)
+        
+        # One tab-separated line per image: <image_path>\t<result>
+        for result in results:
+            print(f"{result['image_path']}\t{format_result(result)}")
+        
+        if any("error" in r for r in results):
+            sys.exit(2)
+        sys.exit(1 if any(r.get('has_text') for r in results) else 0)
+    
     image_path = sys.argv[1]
     confidence = int(sys.argv[2]) if len(sys.argv) > 2 else 30
     
     result = detect_text_in_image(image_path, confidence)
     
+    # Output result as simple format for Go to parse
+    print(format_result(result))
+    
     if "error" in result:
-        print(f"ERROR: {result['error']}")
         sys.exit(2)
     
-    # Output result as simple format for Go to parse
     if result['has_text']:
-        print(f"TEXT_DETECTED:{result['text_count']}:{result['detected_text']}")
         sys.exit(1)  # Exit code 1 = text detected
     else:
-        print("NO_TEXT_DETECTED")
         sys.exit(0)  # Exit code 0 = clean image
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Convert a Whisper checkpoint to a CTranslate2 model directory once, so
+generate_timestamps.py --model-dir can load quantized weights directly
+instead of converting them on every run
+"""
+import argparse
+import subprocess
+import sys
+
+def convert_model(model, output_dir, quantization="int8_float16"):
+    """
+    Run ct2-transformers-converter on a Hugging Face Whisper checkpoint
+    """
+    cmd = [
+        "ct2-transformers-converter",
+        "--model", model,
+        "--quantization", quantization,
+        "--output_dir", output_dir,
+        "--copy_files", "tokenizer.json", "preprocessor_config.json",
+    ]
+    print(f"Converting {model} to {output_dir} ({quantization})...")
+    subprocess.run(cmd, check=True)
+    print(f"✓ Converted model saved to {output_dir}")
+    print(f"✓ Use it with: generate_timestamps.py --model-dir {output_dir}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert a Whisper model to CTranslate2 format')
+    parser.add_argument('--model', default='openai/whisper-large-v3', help='Hugging Face model id (default: openai/whisper-large-v3)')
+    parser.add_argument('--output-dir', default='models/whisper-large-v3-ct2', help='Output directory (default: models/whisper-large-v3-ct2)')
+    parser.add_argument('--quantization', default='int8_float16', help='Weight quantization (default: int8_float16)')
+    
+    args = parser.parse_args()
+    
+    try:
+        convert_model(args.model, args.output_dir, args.quantization)
+        sys.exit(0)
+    except FileNotFoundError:
+        print("ERROR: ct2-transformers-converter not found (pip install ctranslate2 transformers)", file=sys.stderr)
+        sys.exit(1)
+    except subprocess.CalledProcessError as e:
+        print(f"ERROR: conversion failed with exit code {e.returncode}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
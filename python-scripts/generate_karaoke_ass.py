@@ -5,7 +5,14 @@ Generate ASS subtitle file with karaoke effects from timestamps
 import json
 import argparse
 import sys
+import functools
 from dataclasses import dataclass
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 @dataclass
 class KaraokeConfig:
@@ -21,6 +28,7 @@ class KaraokeConfig:
     alignment: int = 5  # 5=center, 2=bottom-center, 8=top-center
     max_chars_per_line: int = 45  # Maximum characters per line to prevent clipping
 
+@functools.lru_cache(maxsize=32)
 def hex_to_ass_color(hex_color):
     """Convert hex color (RGB) to ASS color format (&HAABBGGRR&)"""
     # Remove # if present
@@ -65,6 +73,17 @@ def split_text_intelligently(words_data, max_chars):
     
     return lines
 
+def build_karaoke_text(words):
+    """Build ASS karaoke text with a \\k duration tag (centiseconds) per word"""
+    count = len(words)
+    starts = np.fromiter((w['start'] for w in words), dtype=np.float64, count=count)
+    ends = np.fromiter((w['end'] for w in words), dtype=np.float64, count=count)
+    durations_cs = ((ends - starts) * 100).astype(np.int64)
+    return " ".join(
+        f"{{\\k{duration_cs}}}{word['word'].strip()}"
+        for duration_cs, word in zip(durations_cs.tolist(), words)
+    )
+
 def align_lyrics_with_timings(whisper_segments, actual_lyrics_lines):
     """
     Align actual lyrics with Whisper timings
@@ -118,8 +137,12 @@ def create_karaoke_ass(timestamps_json, output_ass, lyrics_text=None, config=Kar
     If lyrics_text is provided, uses actual lyrics instead of Whisper transcription
     """
     # Load timestamps
-    with open(timestamps_json, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+    if orjson is not None:
+        with open(timestamps_json, 'rb') as f:
+            data = orjson.loads(f.read())
+    else:
+        with open(timestamps_json, 'r', encoding='utf-8') as f:
+            data = json.load(f)
     
     # If actual lyrics provided, align them with Whisper timings
     actual_lyrics_lines = None
@@ -180,8 +203,13 @@ def create_karaoke_ass(timestamps_json, output_ass, lyrics_text=None, config=Kar
         # Align actual lyrics with Whisper timing data
         segments = align_lyrics_with_timings(data['segments'], actual_lyrics_lines)
     
+    # Convert style colors once
+    highlight_color = hex_to_ass_color(config.highlight_color)
+    primary_color = hex_to_ass_color(config.primary_color)
+    primary_border_color = hex_to_ass_color(config.primary_border_color)
+    
     # Create ASS document header
-    ass_content = f"""[Script Info]
+    header = f"""[Script Info]
 Title: Karaoke Subtitles
 ScriptType: v4.00+
 WrapStyle: 2
@@ -191,13 +219,13 @@ ScaledBorderAndShadow: yes
 
 [V4+ Styles]
 Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding
-Style: Karaoke,{config.font_family},{config.font_size},{hex_to_ass_color(config.highlight_color)},{hex_to_ass_color(config.primary_color)},{hex_to_ass_color(config.primary_border_color)},&H80000000&,-1,0,0,0,100,100,0,0,1,{config.outline_width},{config.shadow_depth},{config.alignment},50,50,{config.margin_bottom},1
+Style: Karaoke,{config.font_family},{config.font_size},{highlight_color},{primary_color},{primary_border_color},&H80000000&,-1,0,0,0,100,100,0,0,1,{config.outline_width},{config.shadow_depth},{config.alignment},50,50,{config.margin_bottom},1
 
 [Events]
 Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
 """
     
-    # Process each segment
+    # Collect (start, end, karaoke_text) for each subtitle event
     events = []
     
     for segment in segments:
@@ -223,45 +251,43 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
                 line_end = line_words[-1]['end']
                 
                 # Build karaoke text for this line
-                karaoke_text = ""
-                for word in line_words:
-                    duration_cs = int((word['end'] - word['start']) * 100)
-                    karaoke_text += f"{{\\k{duration_cs}}}{word['word'].strip()} "
-                
-                start_time = format_ass_time(line_start)
-                end_time = format_ass_time(line_end)
-                
-                event = f"Dialogue: 0,{start_time},{end_time},Karaoke,,0,0,0,,{karaoke_text.strip()}"
-                events.append(event)
+                karaoke_text = build_karaoke_text(line_words)
+                events.append((line_start, line_end, karaoke_text))
         else:
             # Line fits on one line - keep as is
-            karaoke_text = ""
-            for word in words:
-                duration_cs = int((word['end'] - word['start']) * 100)
-                karaoke_text += f"{{\\k{duration_cs}}}{word['word'].strip()} "
-            
-            start_time = format_ass_time(segment_start)
-            end_time = format_ass_time(segment_end)
-            
-            event = f"Dialogue: 0,{start_time},{end_time},Karaoke,,0,0,0,,{karaoke_text.strip()}"
-            events.append(event)
+            karaoke_text = build_karaoke_text(words)
+            events.append((segment_start, segment_end, karaoke_text))
     
-    ass_content += "\n".join(events)
+    # Format all event timestamps in one vectorized pass
+    start_times = format_ass_times(np.array([e[0] for e in events], dtype=np.float64))
+    end_times = format_ass_times(np.array([e[1] for e in events], dtype=np.float64))
     
-    # Save ASS file
+    dialogue_lines = (
+        f"Dialogue: 0,{start_time},{end_time},Karaoke,,0,0,0,,{karaoke_text}"
+        for start_time, end_time, (_, _, karaoke_text) in zip(start_times, end_times, events)
+    )
+    
+    # Save ASS file, streaming events instead of joining them into one string
     with open(output_ass, 'w', encoding='utf-8') as f:
-        f.write(ass_content)
+        f.write(header)
+        f.writelines(
+            line if i == 0 else "\n" + line
+            for i, line in enumerate(dialogue_lines)
+        )
     
     print(f"✓ Karaoke ASS saved to {output_ass}")
     print(f"✓ Generated {len(events)} subtitle events")
 
-def format_ass_time(seconds):
-    """Convert seconds to ASS timestamp format (H:MM:SS.CC)"""
-    hours = int(seconds // 3600)
-    minutes = int((seconds % 3600) // 60)
-    secs = int(seconds % 60)
-    centisecs = int((seconds % 1) * 100)
-    return f"{hours}:{minutes:02d}:{secs:02d}.{centisecs:02d}"
+def format_ass_times(seconds):
+    """Convert an array of seconds to ASS timestamp strings (H:MM:SS.CC)"""
+    hours = (seconds // 3600).astype(np.int64)
+    minutes = ((seconds % 3600) // 60).astype(np.int64)
+    secs = (seconds % 60).astype(np.int64)
+    centisecs = ((seconds % 1) * 100).astype(np.int64)
+    return [
+        f"{h}:{m:02d}:{sec:02d}.{cs:02d}"
+        for h, m, sec, cs in zip(hours.tolist(), minutes.tolist(), secs.tolist(), centisecs.tolist())
+    ]
 
 def main():
     parser = argparse.ArgumentParser(description='Generate ASS karaoke subtitles from timestamps')
@@ -3,14 +3,105 @@
 Generate word-level timestamps with automatic fallback:
 1. Try WhisperX on GPU (best quality, fastest)
 2. Fallback to Faster-Whisper on CPU (good quality, reliable)
+
+Models are loaded once per process, so many files can be processed in a
+single run with --manifest (one "vocals_path<TAB>output_json" per stdin line).
 """
 import json
 import argparse
+import contextlib
+import os
 import sys
 
-def try_whisperx(vocals_path, output_json, model_name="large-v3"):
+from segments_json import atomic_output, iter_segment_dicts, write_segments_json
+
+# Map WhisperX model names to Faster-Whisper sizes
+FASTER_WHISPER_MODELS = {
+    "large-v3": "large-v3",
+    "large-v2": "large-v2",
+    "large": "large-v2",
+    "medium": "medium",
+    "small": "small",
+    "base": "base",
+    "tiny": "tiny"
+}
+
+# Next smaller WhisperX model to try when a model does not fit in GPU memory
+SMALLER_MODELS = {
+    "large-v3": "medium",
+    "large-v2": "medium",
+    "large": "medium",
+    "medium": "small",
+}
+
+# CTranslate2 compute types for WhisperX on GPU
+GPU_COMPUTE_TYPES = ["float16", "int8_float16", "int8", "float32"]
+
+# CTranslate2 compute types usable on CPU
+CPU_COMPUTE_TYPES = ["int8", "int8_float32", "float32"]
+
+def resolve_cpu_compute_type(compute_type=None, quality=False):
+    """int8 by default; int8_float32 trades a little speed for accuracy"""
+    return compute_type or ("int8_float32" if quality else "int8")
+
+def default_batch_size(torch):
+    """
+    Pick the WhisperX ASR batch size from GPU memory
+    Larger batches keep the encoder busy; each step up needs roughly 4 GB more VRAM
+    """
+    total_gb = torch.cuda.get_device_properties(0).total_memory / (1024 ** 3)
+    if total_gb >= 16:
+        return 32
+    if total_gb >= 12:
+        return 24
+    return 16
+
+def default_compute_type(torch):
+    """float16, or int8_float16 on GPUs under 10 GiB where large models would not fit"""
+    total_gib = torch.cuda.get_device_properties(0).total_memory / (1024 ** 3)
+    return "int8_float16" if total_gib < 10 else "float16"
+
+def is_ct2_model_dir(path):
+    """True if path is a CTranslate2 model directory (see convert_model.py)"""
+    return bool(path) and os.path.isfile(os.path.join(path, "model.bin"))
+
+# Alignment models by (language_code, device), so reloading the ASR model
+# (e.g. retrying with other settings) never reloads Wav2Vec2 as well
+_ALIGN_CACHE = {}
+
+def get_align_model(lang, device):
+    """Load the WhisperX alignment model for lang on device, once per process"""
+    key = (lang, device)
+    cached = _ALIGN_CACHE.get(key)
+    if cached is None:
+        import whisperx
+        cached = whisperx.load_align_model(language_code=lang, device=device)
+        _ALIGN_CACHE[key] = cached
+    return cached
+
+def compile_module(torch, module):
     """
-    Try WhisperX on GPU first
+    torch.compile a module with dynamic shapes (segment lengths vary)
+    Compile failures fall back to eager execution instead of failing the file
+    """
+    try:
+        import torch._dynamo
+        torch._dynamo.config.suppress_errors = True
+        return torch.compile(module, dynamic=True)
+    except Exception as e:
+        print(f"torch.compile unavailable ({e}), using eager mode")
+        return module
+
+def load_whisperx(model_name="large-v3", batch_size=None, model_dir=None, compile_models=False,
+                  compute_type=None):
+    """
+    Load WhisperX ASR and alignment models on GPU
+    Returns a dict of loaded models, or None if WhisperX is unavailable
+    batch_size and compute_type default to values based on available GPU memory;
+    if the model fails to load, int8_float16 is tried before giving up on the GPU
+    model_dir may point to pre-converted CTranslate2 weights, which load as-is
+    compile_models runs the alignment model through torch.compile; the first
+    file pays the compile time, so this only helps multi-file runs
     """
     try:
         import torch
@@ -22,160 +113,408 @@ def try_whisperx(vocals_path, output_json, model_name="large-v3"):
         torch.load = patched_load
 
         import whisperx
-        import gc
-        
+
         device = "cuda" if torch.cuda.is_available() else None
-        
+
         if device is None:
             print("CUDA not available for WhisperX, falling back to Faster-Whisper")
-            return False
-        
-        batch_size = 16
-        compute_type = "float16"
-        
-        print(f"Using WhisperX on device: {device}")
-        print(f"Loading WhisperX model: {model_name}")
-        
+            return None
+
+        batch_size = batch_size or default_batch_size(torch)
+
+        # Pre-converted int8_float16 weights skip on-the-fly conversion and halve VRAM
+        if is_ct2_model_dir(model_dir):
+            model_name = model_dir
+            compute_type = compute_type or "int8_float16"
+
+        compute_type = compute_type or default_compute_type(torch)
+
+        print(f"Using WhisperX on device: {device} (batch size {batch_size})")
+        print(f"Loading WhisperX model: {model_name} ({compute_type})")
+
         # 1. Load model
-        model = whisperx.load_model(
-            model_name, 
-            device, 
-            compute_type=compute_type,
-            language="en"
-        )
-        
-        # 2. Transcribe with timestamps
-        print(f"Transcribing {vocals_path}...")
-        audio = whisperx.load_audio(vocals_path)
-        result = model.transcribe(audio, batch_size=batch_size)
-        
-        # 3. Align whisper output
-        print("Aligning timestamps...")
-        model_a, metadata = whisperx.load_align_model(
-            language_code=result.get("language", "en"),
-            device=device
-        )
-        
-        result = whisperx.align(
-            result["segments"],
-            model_a,
-            metadata,
-            audio,
+        try:
+            model = whisperx.load_model(
+                model_name,
+                device,
+                compute_type=compute_type,
+                language="en"
+            )
+        except Exception as e:
+            if compute_type == "int8_float16":
+                raise
+            # Usually out of memory; the quantized model needs about half the VRAM
+            print(f"Loading with {compute_type} failed ({e}), retrying with int8_float16")
+            compute_type = "int8_float16"
+            model = whisperx.load_model(
+                model_name,
+                device,
+                compute_type=compute_type,
+                language="en"
+            )
+
+        # Alignment model for the (fixed) transcription language
+        model_a, metadata = get_align_model("en", device)
+
+        # ASR runs in CTranslate2, so only the Wav2Vec2 aligner is a torch module
+        if compile_models:
+            model_a = compile_module(torch, model_a)
+
+        return {
+            "whisperx": whisperx,
+            "device": device,
+            "model": model,
+            "model_a": model_a,
+            "metadata": metadata,
+            "model_name": model_name,
+            "batch_size": batch_size,
+            "initial_batch_size": batch_size,
+            "compute_type": compute_type,
+        }
+
+    except Exception as e:
+        print(f"WhisperX failed: {e}")
+        print("Falling back to Faster-Whisper on CPU...")
+        return None
+
+def transcribe_whisperx(models, vocals_path, audio):
+    """
+    Transcribe one file with the preloaded WhisperX ASR model
+    audio is the file decoded with whisperx.load_audio (16 kHz mono float32)
+    Returns the segments with file-relative timestamps
+    """
+    # 2. Transcribe with timestamps
+    print(f"Transcribing {vocals_path}...")
+
+    # One call over the whole file: WhisperX's own VAD skips the silence and
+    # packs the speech chunks into full batches
+    return models["model"].transcribe(audio, batch_size=models["batch_size"])["segments"]
+
+def align_whisperx(models, segments, audio):
+    """
+    Word-align segments with Wav2Vec2 on the GPU
+    A CUDA OOM here retries only the alignment, on CPU; the transcription is kept
+    """
+    import torch
+    whisperx = models["whisperx"]
+    device = models["device"]
+
+    # 3. Align whisper output (per segment, so only speech frames are aligned)
+    # Upload the waveform once from pinned memory; align() slices it per
+    # segment, and those slices are then already on the device
+    print("Aligning timestamps...")
+    try:
+        audio_t = torch.from_numpy(audio).pin_memory().to(device, non_blocking=True)
+        return whisperx.align(
+            segments,
+            models["model_a"],
+            models["metadata"],
+            audio_t,
             device,
             return_char_alignments=False
         )
-        
-        # Cleanup
-        gc.collect()
-        torch.cuda.empty_cache()
-        del model
-        del model_a
-        
-        # 4. Save result
-        output_data = {"segments": result["segments"], "language": "en", "method": "whisperx"}
-        
-        with open(output_json, 'w', encoding='utf-8') as f:
-            json.dump(output_data, f, indent=2, ensure_ascii=False)
-        
-        total_words = sum(len(seg.get("words", [])) for seg in output_data["segments"])
-        print(f"✓ WhisperX: Saved to {output_json}")
-        print(f"✓ Transcribed {len(output_data['segments'])} segments with {total_words} words")
-        
-        return True
-        
     except Exception as e:
-        print(f"WhisperX failed: {e}")
-        print("Falling back to Faster-Whisper on CPU...")
+        if not is_out_of_memory(e):
+            raise
+    # Outside the except block so the failed attempt's tensors can be freed
+    audio_t = None
+    torch.cuda.empty_cache()
+    print("CUDA out of memory during alignment, aligning on CPU")
+    model_a, metadata = get_align_model("en", "cpu")
+    return whisperx.align(segments, model_a, metadata, audio, "cpu", return_char_alignments=False)
+
+def is_out_of_memory(error):
+    """True for CUDA OOM from either PyTorch (alignment) or CTranslate2 (ASR)"""
+    return "out of memory" in str(error).lower()
+
+def step_down_whisperx(models):
+    """
+    Move the WhisperX ASR model one rung down after a CUDA OOM: halve the batch
+    size, then switch to int8_float16, then load the next smaller model
+    Every reload starts again from the initial batch size, since the smaller
+    weights free memory for it; halving resumes if that still does not fit
+    A failed reload leaves models["model"] as None for the caller to give up on
+    Returns False once there is nothing smaller left to try on the GPU
+    """
+    import torch
+    # An allocation just failed, so hand cached blocks back before retrying
+    torch.cuda.empty_cache()
+
+    if models["batch_size"] > 1:
+        models["batch_size"] = max(1, models["batch_size"] // 2)
+        print(f"CUDA out of memory, retrying with batch size {models['batch_size']}")
+        return True
+
+    if models["compute_type"] != "int8_float16":
+        models["compute_type"] = "int8_float16"
+    elif models["model_name"] in SMALLER_MODELS:
+        models["model_name"] = SMALLER_MODELS[models["model_name"]]
+    else:
         return False
+    models["batch_size"] = models["initial_batch_size"]
+
+    print(f"CUDA out of memory, reloading WhisperX model: {models['model_name']} ({models['compute_type']})")
+    models["model"] = None
+    torch.cuda.empty_cache()
+    try:
+        models["model"] = models["whisperx"].load_model(
+            models["model_name"],
+            models["device"],
+            compute_type=models["compute_type"],
+            language="en"
+        )
+    except Exception as e:
+        if not is_out_of_memory(e):
+            raise
+        # The weights alone do not fit; skip the batch-size rungs for this one
+        models["batch_size"] = 1
+        return step_down_whisperx(models)
+    return True
+
+def transcribe_whisperx_with_retry(models, vocals_path, output_json, audio):
+    """
+    Transcribe, align and save one file with WhisperX
+    ASR OOMs step down batch size / precision / model size so the file stays on
+    the GPU whenever possible; alignment OOMs are handled by align_whisperx
+    Raises the last OOM once every rung has failed
+    Returns the number of words written
+    """
+    while True:
+        try:
+            segments = transcribe_whisperx(models, vocals_path, audio)
+            break
+        except Exception as e:
+            if not is_out_of_memory(e) or not step_down_whisperx(models):
+                raise
+
+    result = align_whisperx(models, segments, audio)
+
+    # 4. Save result
+    output_data = {"segments": result["segments"], "language": "en", "method": "whisperx"}
+
+    with atomic_output(output_json) as f:
+        json.dump(output_data, f, indent=2, ensure_ascii=False)
 
-def use_faster_whisper(vocals_path, output_json, model_size="base"):
+    # align() also returns the flat word list, so counting needs no pass over segments
+    total_words = len(result["word_segments"])
+    print(f"✓ WhisperX: Saved to {output_json}")
+    print(f"✓ Transcribed {len(output_data['segments'])} segments with {total_words} words")
+    return total_words
+
+def release_whisperx(models):
+    """
+    Drop references to the WhisperX models once all files are processed
+    No torch.cuda.empty_cache(): the process exits right after, and emptying
+    the caching allocator only costs time and throws away reusable blocks
+    """
+    models.clear()
+
+def load_faster_whisper(model_size="base", compute_type="int8", threads=None):
     """
-    Fallback to Faster-Whisper on CPU
+    Load Faster-Whisper on CPU, using all cores for CTranslate2's GEMMs by default
     """
     from faster_whisper import WhisperModel
-    
-    print(f"Loading Faster-Whisper model: {model_size} on CPU")
-    model = WhisperModel(model_size, device="cpu", compute_type="int8")
-    
+
+    threads = threads or os.cpu_count()
+    print(f"Loading Faster-Whisper model: {model_size} on CPU ({compute_type}, {threads} threads)")
+    return WhisperModel(model_size, device="cpu", compute_type=compute_type,
+                        cpu_threads=threads, num_workers=2)
+
+def transcribe_faster_whisper(model, vocals_path, output_json, audio=None):
+    """
+    Transcribe one file with a preloaded Faster-Whisper model
+    audio may be the already-decoded 16 kHz waveform, which skips decoding the file again
+    Returns the number of words written
+    """
     print(f"Transcribing {vocals_path}...")
     segments, info = model.transcribe(
-        vocals_path,
+        vocals_path if audio is None else audio,
         word_timestamps=True,
         language="en",
         vad_filter=True,
         vad_parameters=dict(min_silence_duration_ms=500)
     )
-    
-    # Convert to JSON format
-    result = {"segments": [], "language": info.language, "method": "faster-whisper"}
-    
-    for segment in segments:
-        seg_data = {
-            "start": segment.start,
-            "end": segment.end,
-            "text": segment.text.strip(),
-            "words": []
-        }
-        
-        if segment.words:
-            for word in segment.words:
-                seg_data["words"].append({
-                    "word": word.word.strip(),
-                    "start": word.start,
-                    "end": word.end,
-                    "score": word.probability
-                })
-        
-        result["segments"].append(seg_data)
-    
-    # Save results
-    with open(output_json, 'w', encoding='utf-8') as f:
-        json.dump(result, f, indent=2, ensure_ascii=False)
-    
-    total_words = sum(len(seg["words"]) for seg in result["segments"])
+
+    # Write segments as CTranslate2 decodes them instead of collecting them first
+    with atomic_output(output_json) as f:
+        segment_count, total_words = write_segments_json(
+            f, iter_segment_dicts(segments),
+            language=info.language, method="faster-whisper"
+        )
+
     print(f"✓ Faster-Whisper: Saved to {output_json}")
-    print(f"✓ Transcribed {len(result['segments'])} segments with {total_words} words")
+    print(f"✓ Transcribed {segment_count} segments with {total_words} words")
+    return total_words
 
-def generate_word_timestamps(vocals_path, output_json, model_name="large-v3", force_cpu=False):
+def generate_word_timestamps_batch(jobs, model_name="large-v3", force_cpu=False, on_result=None,
+                                   batch_size=None, cpu_compute_type="int8", cpu_threads=None,
+                                   model_dir=None, compile_models=False, compute_type=None):
+    """
+    Generate word-level timestamps for many files, loading each model once
+
+    Args:
+        jobs: Iterable of (vocals_path, output_json) pairs
+        model_name: Model size (for both WhisperX and Faster-Whisper)
+        force_cpu: Skip WhisperX and use Faster-Whisper directly
+        on_result: Optional callback(output_json, word_count, error) per job;
+                   if omitted, the first error is raised
+        batch_size: WhisperX ASR batch size (default: based on GPU memory)
+        cpu_compute_type: Faster-Whisper CTranslate2 compute type
+        cpu_threads: Faster-Whisper CPU threads (default: all cores)
+        model_dir: Optional CTranslate2 model directory used instead of model_name
+        compile_models: torch.compile the WhisperX alignment model
+        compute_type: WhisperX CTranslate2 compute type (default: based on GPU memory)
+    """
+    if model_dir and not is_ct2_model_dir(model_dir):
+        print(f"Warning: {model_dir} is not a CTranslate2 model directory, using {model_name}")
+        model_dir = None
+
+    # Try WhisperX first unless forcing CPU
+    whisperx_models = None if force_cpu else load_whisperx(model_name, batch_size, model_dir, compile_models, compute_type)
+    faster_model = None
+
+    try:
+        for vocals_path, output_json in jobs:
+            try:
+                word_count = None
+                # Decoded once and reused by the CPU fallback if WhisperX fails
+                audio = None
+                if whisperx_models is not None:
+                    try:
+                        audio = whisperx_models["whisperx"].load_audio(vocals_path)
+                        word_count = transcribe_whisperx_with_retry(whisperx_models, vocals_path, output_json, audio)
+                    except Exception as e:
+                        print(f"WhisperX failed: {e}")
+                        print("Falling back to Faster-Whisper on CPU...")
+                        if is_out_of_memory(e) or whisperx_models.get("model") is None:
+                            # Every GPU option has been tried, or a reload failed and
+                            # left no model; later files go straight to CPU
+                            release_whisperx(whisperx_models)
+                            whisperx_models = None
+
+                # Fallback to Faster-Whisper
+                if word_count is None:
+                    if faster_model is None:
+                        faster_model = load_faster_whisper(model_dir or FASTER_WHISPER_MODELS.get(model_name, "base"),
+                                                           cpu_compute_type, cpu_threads)
+                    word_count = transcribe_faster_whisper(faster_model, vocals_path, output_json, audio)
+            except Exception as e:
+                if on_result is None:
+                    raise
+                on_result(output_json, None, e)
+            else:
+                if on_result is not None:
+                    on_result(output_json, word_count, None)
+    finally:
+        # Release models only after the last file, never between files
+        if whisperx_models is not None:
+            release_whisperx(whisperx_models)
+
+def generate_word_timestamps(vocals_path, output_json, model_name="large-v3", force_cpu=False,
+                             batch_size=None, cpu_compute_type="int8", cpu_threads=None,
+                             model_dir=None, compile_models=False, compute_type=None):
     """
     Generate word-level timestamps with automatic fallback
-    
+
     Args:
         vocals_path: Path to vocals.wav
-        output_json: Where to save timestamps  
+        output_json: Where to save timestamps
         model_name: Model size (for both WhisperX and Faster-Whisper)
         force_cpu: Skip WhisperX and use Faster-Whisper directly
+        batch_size: WhisperX ASR batch size (default: based on GPU memory)
+        cpu_compute_type: Faster-Whisper CTranslate2 compute type
+        cpu_threads: Faster-Whisper CPU threads (default: all cores)
+        model_dir: Optional CTranslate2 model directory used instead of model_name
+        compile_models: torch.compile the WhisperX alignment model
+        compute_type: WhisperX CTranslate2 compute type (default: based on GPU memory)
     """
-    # Try WhisperX first unless forcing CPU
-    if not force_cpu:
-        if try_whisperx(vocals_path, output_json, model_name):
-            return
-    
-    # Fallback to Faster-Whisper
-    # Map WhisperX model names to Faster-Whisper sizes
-    model_map = {
-        "large-v3": "large-v3",
-        "large-v2": "large-v2", 
-        "large": "large-v2",
-        "medium": "medium",
-        "small": "small",
-        "base": "base",
-        "tiny": "tiny"
-    }
-    faster_model = model_map.get(model_name, "base")
-    use_faster_whisper(vocals_path, output_json, faster_model)
+    generate_word_timestamps_batch([(vocals_path, output_json)], model_name, force_cpu,
+                                   batch_size=batch_size, cpu_compute_type=cpu_compute_type,
+                                   cpu_threads=cpu_threads, model_dir=model_dir,
+                                   compile_models=compile_models, compute_type=compute_type)
+
+def read_manifest(stream, on_malformed=None):
+    """
+    Yield (vocals_path, output_json) pairs from tab-separated lines
+    Blank lines are skipped; lines without both fields are passed to
+    on_malformed(line, error) and skipped, or raise if no callback is given
+    """
+    for line in stream:
+        line = line.rstrip('\n')
+        if not line.strip():
+            continue
+        vocals_path, sep, output_json = line.partition('\t')
+        if not sep or not vocals_path or not output_json:
+            error = ValueError('expected "vocals_path<TAB>output_json"')
+            if on_malformed is None:
+                raise error
+            on_malformed(line, error)
+            continue
+        yield vocals_path, output_json
+
+def run_manifest(model_name, force_cpu, **options):
+    """
+    Process a stdin manifest, printing one status line per job on stdout:
+    OK<TAB>output_json<TAB>word_count  or  ERR<TAB>output_json<TAB>message
+    Progress messages go to stderr so stdout stays machine-readable.
+    """
+    status_out = sys.stdout
+    failed = []
+
+    def report(output_json, word_count, error):
+        if error is None:
+            print(f"OK\t{output_json}\t{word_count}", file=status_out, flush=True)
+        else:
+            failed.append(output_json)
+            message = str(error).replace('\n', ' ')
+            print(f"ERR\t{output_json}\t{message}", file=status_out, flush=True)
+
+    with contextlib.redirect_stdout(sys.stderr):
+        # Malformed lines are reported as ERR with the line in place of output_json
+        jobs = read_manifest(sys.stdin, on_malformed=lambda line, error: report(line, None, error))
+        generate_word_timestamps_batch(jobs, model_name, force_cpu, report, **options)
+
+    return not failed
 
 def main():
     parser = argparse.ArgumentParser(description='Generate word-level timestamps with GPU/CPU fallback')
-    parser.add_argument('--vocals', required=True, help='Path to vocals.wav')
-    parser.add_argument('--output', required=True, help='Output JSON file')
+    parser.add_argument('--vocals', help='Path to vocals.wav')
+    parser.add_argument('--output', help='Output JSON file')
+    parser.add_argument('--manifest', action='store_true',
+                        help='Read "vocals_path<TAB>output_json" lines from stdin and process them with one model load')
     parser.add_argument('--model', default='large-v3', help='Model size (default: large-v3)')
+    parser.add_argument('--model-dir', help='CTranslate2 model directory (see convert_model.py), overrides --model')
     parser.add_argument('--force-cpu', action='store_true', help='Force CPU mode (skip WhisperX)')
-    
+    parser.add_argument('--batch-size', type=int,
+                        help='WhisperX batch size (default: 32 for >=16 GB VRAM, 24 for >=12 GB, otherwise 16)')
+    parser.add_argument('--compute-type', choices=GPU_COMPUTE_TYPES,
+                        help='WhisperX compute type (default: int8_float16 below 10 GiB VRAM, otherwise float16)')
+    parser.add_argument('--compile', action='store_true',
+                        help='torch.compile the WhisperX alignment model (pays off with --manifest)')
+    parser.add_argument('--threads', type=int, help='Faster-Whisper CPU threads (default: all cores)')
+    parser.add_argument('--cpu-compute-type', choices=CPU_COMPUTE_TYPES,
+                        help='Faster-Whisper compute type (default: int8, or int8_float32 with --quality)')
+    parser.add_argument('--quality', action='store_true',
+                        help='Prefer accuracy over speed for Faster-Whisper (int8_float32)')
+
     args = parser.parse_args()
-    
+
+    if not args.manifest and not (args.vocals and args.output):
+        parser.error('--vocals and --output are required unless --manifest is given')
+
+    options = {
+        "batch_size": args.batch_size,
+        "cpu_compute_type": resolve_cpu_compute_type(args.cpu_compute_type, args.quality),
+        "cpu_threads": args.threads,
+        "model_dir": args.model_dir,
+        "compile_models": args.compile,
+        "compute_type": args.compute_type,
+    }
+
     try:
-        generate_word_timestamps(args.vocals, args.output, args.model, args.force_cpu)
+        if args.manifest:
+            sys.exit(0 if run_manifest(args.model, args.force_cpu, **options) else 1)
+        generate_word_timestamps(args.vocals, args.output, args.model, args.force_cpu, **options)
         sys.exit(0)
     except Exception as e:
         print(f"ERROR: {e}", file=sys.stderr)
@@ -3,20 +3,24 @@
 Generate word-level timestamps using faster-whisper (simpler, fewer dependencies)
 """
 from faster_whisper import WhisperModel
-import json
 import argparse
+import os
 import sys
 
-def generate_word_timestamps(vocals_path, output_json, model_size="base"):
+from segments_json import atomic_output, iter_segment_dicts, write_segments_json
+
+def generate_word_timestamps(vocals_path, output_json, model_size="base", compute_type="int8", threads=None):
     """
     Generate word-level timestamps using faster-whisper
     """
     print(f"Loading Faster-Whisper model: {model_size}")
     
     # Use CPU to avoid CUDA/CuDNN dependency issues
-    # CPU is fast enough for real-time transcription
-    model = WhisperModel(model_size, device="cpu", compute_type="int8")
-    print("Using CPU device")
+    # CPU is fast enough for real-time transcription when all cores are used
+    threads = threads or os.cpu_count()
+    model = WhisperModel(model_size, device="cpu", compute_type=compute_type,
+                         cpu_threads=threads, num_workers=2)
+    print(f"Using CPU device ({compute_type}, {threads} threads)")
     
     print(f"Transcribing {vocals_path}...")
     
@@ -29,48 +33,33 @@ def generate_word_timestamps(vocals_path, output_json, model_size="base"):
         vad_parameters=dict(min_silence_duration_ms=500)
     )
     
-    # Convert to JSON format compatible with ASS generator
-    result = {"segments": [], "language": info.language}
-    
-    for segment in segments:
-        seg_data = {
-            "start": segment.start,
-            "end": segment.end,
-            "text": segment.text.strip(),
-            "words": []
-        }
-        
-        if segment.words:
-            for word in segment.words:
-                seg_data["words"].append({
-                    "word": word.word.strip(),
-                    "start": word.start,
-                    "end": word.end,
-                    "score": word.probability
-                })
-        
-        result["segments"].append(seg_data)
-    
-    # Save results
-    with open(output_json, 'w', encoding='utf-8') as f:
-        json.dump(result, f, indent=2, ensure_ascii=False)
+    # Convert to JSON format compatible with ASS generator, writing each
+    # segment as it is decoded instead of collecting them all first
+    with atomic_output(output_json) as f:
+        segment_count, total_words = write_segments_json(
+            f, iter_segment_dicts(segments), language=info.language
+        )
     
-    total_words = sum(len(seg["words"]) for seg in result["segments"])
     print(f"✓ Timestamps saved to {output_json}")
-    print(f"✓ Transcribed {len(result['segments'])} segments with {total_words} words")
+    print(f"✓ Transcribed {segment_count} segments with {total_words} words")
     
-    return result
+    return total_words
 
 def main():
     parser = argparse.ArgumentParser(description='Generate word-level timestamps using faster-whisper')
     parser.add_argument('--vocals', required=True, help='Path to vocals.wav')
     parser.add_argument('--output', required=True, help='Output JSON file')
     parser.add_argument('--model', default='base', help='Whisper model size (tiny, base, small, medium, large-v3)')
+    parser.add_argument('--threads', type=int, help='CPU threads (default: all cores)')
+    parser.add_argument('--compute-type', choices=['int8', 'int8_float32', 'float32'],
+                        help='CTranslate2 compute type (default: int8, or int8_float32 with --quality)')
+    parser.add_argument('--quality', action='store_true', help='Prefer accuracy over speed (int8_float32)')
     
     args = parser.parse_args()
+    compute_type = args.compute_type or ("int8_float32" if args.quality else "int8")
     
     try:
-        generate_word_timestamps(args.vocals, args.output, args.model)
+        generate_word_timestamps(args.vocals, args.output, args.model, compute_type, args.threads)
         sys.exit(0)
     except Exception as e:
         print(f"ERROR: {e}", file=sys.stderr)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Timestamp JSON output shared by generate_timestamps.py and generate_timestamps_faster.py
+"""
+import contextlib
+import json
+import os
+import tempfile
+import textwrap
+
+@contextlib.contextmanager
+def atomic_output(path):
+    """
+    Open a temp file next to path for writing and move it into place on success
+    If writing fails or is interrupted, path is left untouched and the temp file removed
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    f = tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=directory,
+                                    prefix=os.path.basename(path) + '.', suffix='.tmp', delete=False)
+    try:
+        with f:
+            yield f
+        os.replace(f.name, path)
+    except BaseException:
+        os.unlink(f.name)
+        raise
+
+def iter_segment_dicts(segments):
+    """Convert Faster-Whisper segments to JSON-ready dicts, one at a time"""
+    for segment in segments:
+        seg_data = {
+            "start": segment.start,
+            "end": segment.end,
+            "text": segment.text.strip(),
+            "words": []
+        }
+
+        if segment.words:
+            for word in segment.words:
+                seg_data["words"].append({
+                    "word": word.word.strip(),
+                    "start": word.start,
+                    "end": word.end,
+                    "score": word.probability
+                })
+
+        yield seg_data
+
+def write_segments_json(f, segments, **fields):
+    """
+    Stream segment dicts to f as they are decoded, laid out like json.dump(indent=2)
+    Extra keyword fields are written after the segments list
+    Returns (segment_count, word_count)
+    """
+    segment_count = 0
+    word_count = 0
+    f.write('{\n  "segments": [')
+    for seg_data in segments:
+        f.write(',\n' if segment_count else '\n')
+        f.write(textwrap.indent(json.dumps(seg_data, indent=2, ensure_ascii=False), '    '))
+        segment_count += 1
+        word_count += len(seg_data["words"])
+    f.write('\n  ]' if segment_count else ']')
+    for key, value in fields.items():
+        f.write(f',\n  {json.dumps(key)}: {json.dumps(value, ensure_ascii=False)}')
+    f.write('\n}')
+    return segment_count, word_count
@@ -29,42 +29,52 @@ QUALITY_PATTERNS = [
     r',?\s*professional quality',
 ]
 
+# One case-insensitive alternation so each prompt is scanned once instead of
+# once per pattern; longer variations are listed first so they win
+QUALITY_RE = re.compile('|'.join(f'(?:{p})' for p in QUALITY_PATTERNS), re.IGNORECASE)
+_TRAILING_COMMA = re.compile(r'\s*,\s*$')
+_WS = re.compile(r'\s+')
+
 def clean_prompt(prompt):
     """Remove all quality modifier variations from prompt"""
     if not prompt:
         return prompt
     
-    cleaned = prompt
-    
-    # Apply each pattern
-    for pattern in QUALITY_PATTERNS:
-        cleaned = re.sub(pattern, '', cleaned, flags=re.IGNORECASE)
+    cleaned = QUALITY_RE.sub('', prompt)
     
     # Clean up any trailing commas and extra spaces
-    cleaned = re.sub(r'\s*,\s*$', '', cleaned)
-    cleaned = re.sub(r'\s+', ' ', cleaned)
+    cleaned = _TRAILING_COMMA.sub('', cleaned)
+    cleaned = _WS.sub(' ', cleaned)
     cleaned = cleaned.strip()
     
     return cleaned
 
 def main():
     conn = sqlite3.connect(DB_PATH)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    # Take the write lock up front so the whole cleanup is one transaction
+    conn.execute("BEGIN IMMEDIATE")
     cursor = conn.cursor()
     
-    # Get all prompts
-    cursor.execute("SELECT id, prompt FROM generated_images WHERE prompt IS NOT NULL")
-    rows = cursor.fetchall()
-    
-    print(f"Processing {len(rows)} prompts...")
+    total = cursor.execute("SELECT COUNT(*) FROM generated_images WHERE prompt IS NOT NULL").fetchone()[0]
+    print(f"Processing {total} prompts...")
     
-    updated = 0
-    for img_id, prompt in rows:
-        cleaned = clean_prompt(prompt)
-        if cleaned != prompt:
-            cursor.execute("UPDATE generated_images SET prompt = ? WHERE id = ?", (cleaned, img_id))
-            updated += 1
+    # Stream prompts in chunks rather than materializing the whole table
+    reader = conn.execute("SELECT id, prompt FROM generated_images WHERE prompt IS NOT NULL")
+    updates = []
+    while True:
+        rows = reader.fetchmany(1000)
+        if not rows:
+            break
+        for img_id, prompt in rows:
+            cleaned = clean_prompt(prompt)
+            if cleaned != prompt:
+                updates.append((cleaned, img_id))
     
+    cursor.executemany("UPDATE generated_images SET prompt = ? WHERE id = ?", updates)
     conn.commit()
+    updated = len(updates)
     
     print(f"✅ Updated {updated} prompts")
     print(f"✅ Cleared all negative prompts")
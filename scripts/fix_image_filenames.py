@@ -22,6 +22,30 @@ RENAME_MAP = {
     "bg-outro-1.png": "bg-outro.png",
 }
 
+# Renames per UPDATE statement (two bound parameters each); SQLite before
+# 3.32 allows at most 999 bound variables per statement
+DB_UPDATE_CHUNK = 499
+
+def update_image_paths(cursor, db_updates):
+    """
+    Rewrite image_path for (new_path, old_path) pairs with one UPDATE per chunk
+    image_path is not indexed, so each per-row UPDATE would scan the whole table
+    Returns the number of rows updated
+    """
+    updated = 0
+    for i in range(0, len(db_updates), DB_UPDATE_CHUNK):
+        chunk = db_updates[i:i + DB_UPDATE_CHUNK]
+        cases = " ".join(f"WHEN ?{2*j + 1} THEN ?{2*j + 2}" for j in range(len(chunk)))
+        olds = ", ".join(f"?{2*j + 1}" for j in range(len(chunk)))
+        params = [value for new_path, old_path in chunk for value in (old_path, new_path)]
+        cursor.execute(f"""
+            UPDATE generated_images 
+            SET image_path = CASE image_path {cases} END 
+            WHERE image_path IN ({olds})
+        """, params)
+        updated += cursor.rowcount
+    return updated
+
 def main():
     renamed_count = 0
     db_updates = []
@@ -31,24 +55,26 @@ def main():
         print(f"❌ Images directory not found: {IMAGES_DIR}")
         return
     
-    for song_dir in IMAGES_DIR.iterdir():
+    for song_dir in os.scandir(IMAGES_DIR):
         if not song_dir.is_dir() or not song_dir.name.startswith("song_"):
             continue
         
         print(f"\n📁 Processing {song_dir.name}...")
         
+        # One directory listing per song instead of two stat calls per mapping
+        names = {entry.name for entry in os.scandir(song_dir.path)}
+        
         for old_name, new_name in RENAME_MAP.items():
-            old_path = song_dir / old_name
-            new_path = song_dir / new_name
-            
-            if old_path.exists():
+            if old_name in names:
                 # If target already exists, we need to decide what to do
-                if new_path.exists():
+                if new_name in names:
                     print(f"  ⚠️  {new_name} already exists, skipping {old_name}")
                     continue
                 
                 # Rename the file
-                old_path.rename(new_path)
+                os.rename(os.path.join(song_dir.path, old_name), os.path.join(song_dir.path, new_name))
+                names.discard(old_name)
+                names.add(new_name)
                 print(f"  ✅ Renamed: {old_name} → {new_name}")
                 renamed_count += 1
                 
@@ -64,17 +90,15 @@ def main():
         print(f"\n🗄️  Updating database records...")
         try:
             conn = sqlite3.connect(DB_PATH)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("BEGIN IMMEDIATE")
             cursor = conn.cursor()
             
-            for new_path, old_path in db_updates:
-                cursor.execute("""
-                    UPDATE generated_images 
-                    SET image_path = ? 
-                    WHERE image_path = ?
-                """, (new_path, old_path))
+            updated = update_image_paths(cursor, db_updates)
             
             conn.commit()
-            print(f"  ✅ Updated {cursor.rowcount} database records")
+            print(f"  ✅ Updated {updated} database records")
             conn.close()
         except Exception as e:
             print(f"  ❌ Database error: {e}")
@@ -5,67 +5,76 @@ Extracts metadata from filenames and video properties.
 """
 
 import os
+import re
 import sqlite3
 import json
-from pathlib import Path
 import subprocess
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
-def get_video_duration(video_path):
-    """Get video duration using ffprobe"""
+def resolution_label(height):
+    """Map a pixel height to a resolution label"""
+    if height >= 2160:
+        return '4k'
+    elif height >= 1080:
+        return '1080p'
+    elif height >= 720:
+        return '720p'
+    else:
+        return '480p'
+
+def probe_video(video_path):
+    """Get video duration and resolution label with a single ffprobe call"""
     try:
         result = subprocess.run(
-            ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', 
+            ['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+             '-show_entries', 'stream=width,height:format=duration',
              '-of', 'json', video_path],
             capture_output=True,
             text=True,
             check=True
         )
         data = json.loads(result.stdout)
-        return float(data['format']['duration'])
+    except Exception as e:
+        print(f"Warning: Could not probe {video_path}: {e}")
+        return None, '4k'  # Default assumption
+    
+    try:
+        duration = float(data['format']['duration'])
     except Exception as e:
         print(f"Warning: Could not get duration for {video_path}: {e}")
-        return None
-
-def get_video_resolution(video_path):
-    """Get video resolution using ffprobe"""
+        duration = None
+    
     try:
-        result = subprocess.run(
-            ['ffprobe', '-v', 'error', '-select_streams', 'v:0',
-             '-show_entries', 'stream=width,height', '-of', 'json', video_path],
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        data = json.loads(result.stdout)
-        width = data['streams'][0]['width']
-        height = data['streams'][0]['height']
-        
-        # Determine resolution label
-        if height >= 2160:
-            return '4k'
-        elif height >= 1080:
-            return '1080p'
-        elif height >= 720:
-            return '720p'
-        else:
-            return '480p'
+        resolution = resolution_label(data['streams'][0]['height'])
     except Exception as e:
         print(f"Warning: Could not get resolution for {video_path}: {e}")
-        return '4k'  # Default assumption
+        resolution = '4k'  # Default assumption
+    
+    return duration, resolution
+
+_PAREN_RE = re.compile(r'\([^)]*\)')
+_NONALNUM_RE = re.compile(r'[^a-z0-9\s]')
 
 def normalize_title(title):
     """Normalize title for matching - remove special chars, lowercase"""
-    import re
     # Remove anything in parentheses
-    title = re.sub(r'\([^)]*\)', '', title)
+    title = _PAREN_RE.sub('', title)
     # Remove special characters and extra spaces
-    title = re.sub(r'[^a-z0-9\s]', '', title.lower())
+    title = _NONALNUM_RE.sub('', title.lower())
     # Collapse multiple spaces
     title = ' '.join(title.split())
     return title.strip()
 
-def find_song_by_filename(cursor, filename):
+def build_song_index(cursor):
+    """Map normalized song titles to song IDs, keeping the first song per title"""
+    cursor.execute("SELECT id, title FROM songs")
+    song_index = {}
+    for song_id, song_title in cursor.fetchall():
+        song_index.setdefault(normalize_title(song_title), song_id)
+    return song_index
+
+def find_song_by_filename(song_index, filename):
     """Find song ID by matching filename to song title"""
     # Remove .mp4 extension
     base_name = filename.replace('.mp4', '')
@@ -74,27 +83,32 @@ def find_song_by_filename(cursor, filename):
     
     normalized_search = normalize_title(search_title)
     
-    # Get all songs
-    cursor.execute("SELECT id, title FROM songs")
-    songs = cursor.fetchall()
+    # Check for exact match
+    song_id = song_index.get(normalized_search)
+    if song_id is not None:
+        return song_id
     
-    for song_id, song_title in songs:
-        normalized_song = normalize_title(song_title)
-        
-        # Check for exact match
-        if normalized_search == normalized_song:
-            return song_id
-        
-        # Check if one contains the other
+    # Check if one contains the other
+    for normalized_song, song_id in song_index.items():
         if normalized_search in normalized_song or normalized_song in normalized_search:
             return song_id
     
     return None
 
+def iter_mp4s(root):
+    """Yield DirEntry objects for every .mp4 file under root"""
+    for entry in os.scandir(root):
+        if entry.is_dir(follow_symlinks=False):
+            yield from iter_mp4s(entry.path)
+        elif entry.name.endswith('.mp4'):
+            yield entry
+
 def populate_videos_table(db_path, storage_dir):
     """Scan videos directory and populate videos table"""
     
     conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
     cursor = conn.cursor()
     
     # Get all video files
@@ -103,92 +117,104 @@ def populate_videos_table(db_path, storage_dir):
         print(f"Videos directory not found: {videos_dir}")
         return
     
-    video_files = list(Path(videos_dir).rglob('*.mp4'))
+    # DirEntry caches its stat result, so size and mtime below cost one stat
+    video_files = list(iter_mp4s(videos_dir))
     print(f"Found {len(video_files)} video files")
     
-    inserted = 0
+    # Normalize every song title once instead of once per video
+    song_index = build_song_index(cursor)
+    
+    # Prefetch song metadata and known video paths so the loop needs no queries
+    cursor.execute("SELECT id, genre, bpm, key, tempo FROM songs")
+    song_meta = {row[0]: row[1:] for row in cursor.fetchall()}
+    cursor.execute("SELECT video_file_path FROM videos")
+    existing_paths = {row[0] for row in cursor.fetchall()}
+    
+    conn.execute("BEGIN IMMEDIATE")
+    
+    to_insert = []
+    inserted_labels = []
     skipped = 0
     errors = 0
     songs_created = 0
     
-    for video_path in video_files:
-        video_path_str = str(video_path)
-        filename = video_path.name
-        
-        # Find song by matching filename to title
-        song_id = find_song_by_filename(cursor, filename)
+    # ffprobe is fork/IO-bound, so probe all videos concurrently up front;
+    # results come back in order while the DB work below stays on this thread
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        probes = executor.map(probe_video, [entry.path for entry in video_files])
         
-        # If no song found, create a placeholder song record
-        if song_id is None:
-            song_title = filename.replace('.mp4', '').replace('_', ' ')
-            print(f"Creating placeholder song for: {song_title}")
+        for entry, (duration, resolution) in zip(video_files, probes):
+            video_path_str = entry.path
+            filename = entry.name
             
-            try:
-                cursor.execute("""
-                    INSERT INTO songs 
-                    (title, artist_name, vocals_stem_path, music_stem_path, lyrics)
-                    VALUES (?, 'Tristan Hart', '', '', 'Lyrics not available')
-                """, (song_title,))
-                song_id = cursor.lastrowid
-                songs_created += 1
-                print(f"  → Created song ID {song_id}")
-            except Exception as e:
-                print(f"  ✗ Failed to create song: {e}")
-                errors += 1
+            # Find song by matching filename to title
+            song_id = find_song_by_filename(song_index, filename)
+            
+            # If no song found, create a placeholder song record
+            if song_id is None:
+                song_title = filename.replace('.mp4', '').replace('_', ' ')
+                print(f"Creating placeholder song for: {song_title}")
+                
+                try:
+                    cursor.execute("""
+                        INSERT INTO songs 
+                        (title, artist_name, vocals_stem_path, music_stem_path, lyrics)
+                        VALUES (?, 'Tristan Hart', '', '', 'Lyrics not available')
+                    """, (song_title,))
+                    song_id = cursor.lastrowid
+                    song_index.setdefault(normalize_title(song_title), song_id)
+                    songs_created += 1
+                    print(f"  → Created song ID {song_id}")
+                except Exception as e:
+                    print(f"  ✗ Failed to create song: {e}")
+                    errors += 1
+                    continue
+            
+            # Make path relative to storage directory
+            rel_path = os.path.relpath(video_path_str, storage_dir)
+            
+            if rel_path in existing_paths:
+                # Video already exists
+                skipped += 1
+                print(f"⊗ Skipped: {filename} (already in database)")
                 continue
-        
-        # Check if song exists
-        cursor.execute("SELECT id FROM songs WHERE id = ?", (song_id,))
-        if not cursor.fetchone():
-            print(f"Skipping {video_path.name} - song ID {song_id} not found in database")
-            skipped += 1
-            continue
-        
-        # Get video metadata
-        file_size = os.path.getsize(video_path_str)
-        duration = get_video_duration(video_path_str)
-        resolution = get_video_resolution(video_path_str)
-        
-        # Get file modification time as rendered_at
-        mtime = os.path.getmtime(video_path_str)
-        from datetime import datetime
-        rendered_at = datetime.fromtimestamp(mtime).isoformat()
-        
-        # Get metadata from song
-        cursor.execute("""
-            SELECT genre, bpm, key, tempo FROM songs WHERE id = ?
-        """, (song_id,))
-        song_metadata = cursor.fetchone()
-        genre = song_metadata[0] if song_metadata else None
-        bpm = song_metadata[1] if song_metadata else None
-        key = song_metadata[2] if song_metadata else None
-        tempo = song_metadata[3] if song_metadata else None
-        
-        # Make path relative to storage directory
-        rel_path = os.path.relpath(video_path_str, storage_dir)
-        
-        try:
-            # Insert into videos table
-            cursor.execute("""
-                INSERT INTO videos 
-                (song_id, video_file_path, resolution, duration_seconds, 
-                 file_size_bytes, status, rendered_at, genre, bpm, key, tempo)
-                VALUES (?, ?, ?, ?, ?, 'completed', ?, ?, ?, ?, ?)
-            """, (song_id, rel_path, resolution, duration, file_size, rendered_at,
-                  genre, bpm, key, tempo))
+            existing_paths.add(rel_path)
+            
+            # Get video metadata
+            stat = entry.stat()
+            file_size = stat.st_size
+            
+            # Get file modification time as rendered_at
+            mtime = stat.st_mtime
+            from datetime import datetime
+            rendered_at = datetime.fromtimestamp(mtime).isoformat()
             
-            inserted += 1
-            print(f"✓ Inserted: {video_path.name} (Song {song_id}, {resolution}, {file_size/1024/1024:.1f}MB)")
+            # Get metadata from song (placeholder songs have none)
+            genre, bpm, key, tempo = song_meta.get(song_id, (None, None, None, None))
             
-        except sqlite3.IntegrityError:
-            # Video already exists
-            skipped += 1
-            print(f"⊗ Skipped: {video_path.name} (already in database)")
-        except Exception as e:
-            errors += 1
-            print(f"✗ Error: {video_path.name} - {e}")
-    
-    conn.commit()
+            to_insert.append((song_id, rel_path, resolution, duration, file_size, rendered_at,
+                              genre, bpm, key, tempo))
+            inserted_labels.append(f"{filename} (Song {song_id}, {resolution}, {file_size/1024/1024:.1f}MB)")
+    
+    inserted = 0
+    try:
+        # Insert into videos table
+        cursor.executemany("""
+            INSERT INTO videos 
+            (song_id, video_file_path, resolution, duration_seconds, 
+             file_size_bytes, status, rendered_at, genre, bpm, key, tempo)
+            VALUES (?, ?, ?, ?, ?, 'completed', ?, ?, ?, ?, ?)
+        """, to_insert)
+        conn.commit()
+        inserted = len(to_insert)
+        for label in inserted_labels:
+            print(f"✓ Inserted: {label}")
+    except Exception as e:
+        conn.rollback()
+        errors += len(to_insert)
+        songs_created = 0
+        print(f"✗ Error inserting videos, no changes saved: {e}")
+    
     conn.close()
     
     print(f"\n{'='*60}")
@@ -12,6 +12,8 @@ REQUIREMENTS="$SCRIPT_DIR/requirements.txt"
 HOST="0.0.0.0"
 PORT="8181"
 LOG_FILE="$SCRIPT_DIR/whisperx_api.log"
+# Default GPU for requests that don't pass a device (GPU 1 is the RTX 3090 on CQAI)
+export WHISPERX_DEVICE="${WHISPERX_DEVICE:-cuda:1}"
 
 # Function to check if port is in use
 check_port() {
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Tests for the WhisperX API service that run without torch, whisperx or a GPU
+Run with: python -m pytest scripts/test_whisperx_api.py
+"""
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import whisperx_api
+
+@pytest.fixture
+def client():
+    # Not entered as a context manager, so startup never spawns GPU workers
+    yield TestClient(whisperx_api.app)
+    whisperx_api.jobs.clear()
+    whisperx_api.active_jobs.clear()
+
+def test_status_serializes_numpy_values(client):
+    """Finished results may keep numpy scalars from alignment; /status must encode them"""
+    segment = {"start": np.float32(1.5), "end": np.float64(2.25), "text": "hello", "words": []}
+    with whisperx_api.jobs_lock:
+        whisperx_api.jobs["numpy-job"] = {"status": "completed", "result": {"json_data": {"segments": [segment]}}}
+    response = client.get("/status/numpy-job")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["status"] == "completed"
+    assert body["error"] is None
+    assert body["result"]["json_data"]["segments"][0]["start"] == 1.5
+    assert body["result"]["json_data"]["segments"][0]["end"] == 2.25
+
+def test_status_of_processing_job(client):
+    with whisperx_api.jobs_lock:
+        whisperx_api.active_jobs["running-job"] = {"status": "processing"}
+    response = client.get("/status/running-job")
+    assert response.json() == {"status": "processing", "result": None, "error": None}
+
+def test_status_of_unknown_job(client):
+    assert client.get("/status/missing").status_code == 404
+
+@pytest.mark.parametrize("device, expected", [("cuda:01", "cuda:1"), ("cuda:1", "cuda:1"), ("cuda:000", "cuda:0"), ("cpu", "cpu")])
+def test_normalize_device(device, expected):
+    assert whisperx_api.normalize_device(device) == expected
+
+def test_equivalent_devices_share_a_worker(client, monkeypatch):
+    """cuda:01 and cuda:1 name the same GPU, so both must reach the same worker"""
+    devices = []
+    async def fake_transcribe(audio_path, language, model_name, align_mode, lyrics_file, device, formats):
+        devices.append(device)
+        return {"transcription": "ok"}
+    monkeypatch.setattr(whisperx_api, "transcribe_in_worker", fake_transcribe)
+    for device in ("cuda:01", "cuda:1"):
+        response = client.post(f"/transcribe/sync?device={device}&formats=txt", files={"file": ("a.wav", b"RIFF", "audio/wav")})
+        assert response.status_code == 200
+    assert devices == ["cuda:1", "cuda:1"]
+
+def test_invalid_device_is_rejected(client):
+    response = client.post("/transcribe/sync?device=gpu0", files={"file": ("a.wav", b"RIFF", "audio/wav")})
+    assert response.status_code == 400
+
+@pytest.mark.parametrize("filename, suffix", [("song.MP3", ".mp3"), ("take.flac", ".flac"), ("vox.wav", ".wav")])
+def test_staged_upload_keeps_its_suffix(client, monkeypatch, filename, suffix):
+    """ffmpeg picks the decoder from the extension, so staged files must keep it, pooled or not"""
+    staged = []
+    async def fake_transcribe(audio_path, language, model_name, align_mode, lyrics_file, device, formats):
+        staged.append(audio_path)
+        return {"transcription": "ok"}
+    monkeypatch.setattr(whisperx_api, "transcribe_in_worker", fake_transcribe)
+    for _ in range(2):
+        response = client.post("/transcribe/sync?formats=txt", files={"file": (filename, b"data", "audio/mpeg")})
+        assert response.status_code == 200
+    assert all(path.endswith(suffix) for path in staged)
@@ -3,31 +3,44 @@
 Update audio analysis for all songs in the database
 Runs analyzer.py on each song's instrumental track and updates the database
 """
+import argparse
+import importlib.util
+import multiprocessing
 import sqlite3
-import json
-import subprocess
 import sys
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 
 # Database path
 DB_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'trackstudio.db')
 ANALYZER_PATH = os.path.join(os.path.dirname(__file__), '..', 'pkg', 'audio', 'analyzer.py')
 
+_analyzer = None
+
+def load_analyzer():
+    """
+    Import analyzer.py once per worker process
+    Loaded lazily so the parent never imports librosa/torch before starting workers
+    """
+    global _analyzer
+    if _analyzer is None:
+        spec = importlib.util.spec_from_file_location("analyzer", ANALYZER_PATH)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _analyzer = module
+    return _analyzer
+
+def init_worker():
+    """Load the analyzer and apply its batch-worker setup: one BLAS thread, CPU only"""
+    load_analyzer()._init_batch_worker()
+
 def analyze_audio_file(file_path):
-    """Run analyzer.py on a file and return results"""
+    """Run the analyzer on a file in this process and return results"""
     try:
-        result = subprocess.run(
-            ['python3', ANALYZER_PATH, file_path],
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        return json.loads(result.stdout)
-    except subprocess.CalledProcessError as e:
-        print(f"Error analyzing {file_path}: {e.stderr}")
-        return None
-    except json.JSONDecodeError as e:
-        print(f"Error parsing JSON for {file_path}: {e}")
+        return load_analyzer().analyze_audio(file_path)
+    except Exception as e:
+        print(f"Error analyzing {file_path}: {e}")
         return None
 
 def update_song_analysis(conn, song_id, analysis):
@@ -58,6 +71,11 @@ def update_song_analysis(conn, song_id, analysis):
     return True
 
 def main():
+    parser = argparse.ArgumentParser(description='Update audio analysis for songs in the database')
+    parser.add_argument('--force', action='store_true',
+                        help='Re-analyze songs that already have BPM and key')
+    args = parser.parse_args()
+    
     print("🎵 Audio Analysis Update Script\n")
     print("=" * 60)
     
@@ -65,17 +83,18 @@ def main():
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
     
-    # Get all songs with their audio paths
+    # Get songs still missing BPM or key (or all songs with --force)
     cursor.execute("""
         SELECT id, title, music_stem_path, bpm, key
         FROM songs 
+        WHERE bpm IS NULL OR bpm = 0 OR key IS NULL OR key = '' OR ? = 1
         ORDER BY id
-    """)
+    """, (int(args.force),))
     
     songs = cursor.fetchall()
     
     if not songs:
-        print("No songs found in database")
+        print("No songs need analysis (use --force to re-analyze)")
         return
     
     print(f"\nFound {len(songs)} songs to analyze\n")
@@ -83,34 +102,53 @@ def main():
     success_count = 0
     fail_count = 0
     
+    pending = []
     for song_id, title, music_stem_path, current_bpm, current_key in songs:
-        print(f"📀 Song {song_id}: {title}")
-        bpm_str = f"{current_bpm:.2f}" if current_bpm else "0"
-        print(f"   Current: BPM={bpm_str}, Key={current_key or 'N/A'}")
-        
         if not music_stem_path or not os.path.exists(music_stem_path):
-            print(f"   ❌ Audio file not found: {music_stem_path}")
+            print(f"📀 Song {song_id}: {title}")
+            print(f"   ❌ Audio file not found: {music_stem_path}\n")
             fail_count += 1
             continue
+        pending.append((song_id, title, music_stem_path, current_bpm, current_key))
+    
+    # Analysis is CPU-bound, so run songs in parallel; results are written
+    # back from this process only so SQLite keeps a single writer
+    workers = max(1, (os.cpu_count() or 1) - 1)
+    print(f"🔍 Analyzing {len(pending)} songs with {workers} workers\n")
+    
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = {
+            executor.submit(analyze_audio_file, song[2]): song
+            for song in pending
+        }
         
-        # Analyze audio
-        print(f"   🔍 Analyzing: {os.path.basename(music_stem_path)}")
-        analysis = analyze_audio_file(music_stem_path)
-        
-        if analysis and analysis.get('success'):
-            # Update database
-            if update_song_analysis(conn, song_id, analysis):
-                print(f"   ✅ Updated: BPM={analysis['bpm']:.2f}, Key={analysis['key']}, Tempo={analysis['tempo']}, Duration={analysis['duration_seconds']:.2f}s")
-                success_count += 1
+        for future in as_completed(futures):
+            song_id, title, music_stem_path, current_bpm, current_key = futures[future]
+            try:
+                analysis = future.result()
+            except BrokenProcessPool as e:
+                # A worker died (e.g. OOM-killed); this and every pending song fail
+                analysis = {'success': False, 'error': f'Worker process crashed: {e}'}
+            
+            print(f"📀 Song {song_id}: {title} ({os.path.basename(music_stem_path)})")
+            bpm_str = f"{current_bpm:.2f}" if current_bpm else "0"
+            print(f"   Current: BPM={bpm_str}, Key={current_key or 'N/A'}")
+            
+            if analysis and analysis.get('success'):
+                # Update database
+                if update_song_analysis(conn, song_id, analysis):
+                    print(f"   ✅ Updated: BPM={analysis['bpm']:.2f}, Key={analysis['key']}, Tempo={analysis['tempo']}, Duration={analysis['duration_seconds']:.2f}s")
+                    success_count += 1
+                else:
+                    print(f"   ❌ Failed to update database")
+                    fail_count += 1
             else:
-                print(f"   ❌ Failed to update database")
+                error_msg = analysis.get('error', 'Unknown error') if analysis else 'Analysis failed'
+                print(f"   ❌ Analysis failed: {error_msg}")
                 fail_count += 1
-        else:
-            error_msg = analysis.get('error', 'Unknown error') if analysis else 'Analysis failed'
-            print(f"   ❌ Analysis failed: {error_msg}")
-            fail_count += 1
-        
-        print()
+            
+            print()
     
     conn.close()
     
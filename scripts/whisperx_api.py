@@ -4,16 +4,31 @@ WhisperX API Service for CQAI
 Provides REST API endpoints for audio transcription and timing extraction
 """
 
+import asyncio
+import contextlib
+import multiprocessing as mp
 import os
+import queue
+import re
 import subprocess
 import tempfile
-import shutil
 import json
+import math
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 from typing import Optional, Dict, Any
+import aiofiles
+import numpy as np
+import orjson
+import psutil
 import uvicorn
+from cachetools import TTLCache
 from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 import logging
 # Import torch only when needed
@@ -25,12 +40,19 @@ WHISPERX_AVAILABLE = True
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="WhisperX API", description="Audio transcription and timing API using WhisperX")
+class ORJSONResponse(JSONResponse):
+    """JSON response encoded by orjson, which also handles numpy scalars/arrays left in segments"""
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY)
+
+app = FastAPI(title="WhisperX API", description="Audio transcription and timing API using WhisperX",
+              default_response_class=ORJSONResponse)
 
 class TranscriptionRequest(BaseModel):
     audio_url: Optional[str] = None
     language: str = "en"
     model: str = "large-v2"
+    device: Optional[str] = None
     align_mode: bool = False
     lyrics_text: Optional[str] = None
 
@@ -44,109 +66,581 @@ class TranscriptionStatus(BaseModel):
     result: Optional[Dict[str, Any]] = None
     error: Optional[str] = None
 
-# In-memory job storage (in production, use Redis or database)
-jobs = {}
+# In-memory job storage (in production, use Redis or database). Jobs still
+# processing live in active_jobs so they can never expire; finished ones move
+# to the bounded jobs cache and expire after an hour
+active_jobs: Dict[str, Dict[str, Any]] = {}
+jobs = TTLCache(maxsize=10_000, ttl=3600)
+jobs_lock = threading.Lock()
+
+# Device used when a request doesn't name one, e.g. WHISPERX_DEVICE=cuda:1
+DEFAULT_DEVICE = os.environ.get("WHISPERX_DEVICE", "cuda:0")
+DEVICE_RE = re.compile(r"cuda:\d+|cpu")
+DEFAULT_MODEL = "large-v2"
+
+# Whisper checkpoints faster-whisper can download by name
+ALLOWED_MODELS = frozenset({
+    "tiny", "tiny.en", "base", "base.en", "small", "small.en", "medium", "medium.en",
+    "large", "large-v1", "large-v2", "large-v3", "large-v3-turbo", "turbo",
+    "distil-small.en", "distil-medium.en", "distil-large-v2", "distil-large-v3",
+})
+
+# Audio formats accepted for upload
+ALLOWED_SUFFIXES = frozenset({".wav", ".mp3", ".m4a", ".flac", ".ogg"})
+
+# Result formats: plain text, SRT, WebVTT and segment JSON
+ALL_FORMATS = frozenset({"txt", "srt", "vtt", "json"})
+
+# Sync responses stream this many segments per chunk
+STREAM_SEGMENTS_PER_CHUNK = 64
+
+# Uploads are copied to disk in chunks this size
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# Stage uploads in RAM-backed tmpfs when it exists, unless an upload would
+# take more than this share of available memory
+SHM_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+SHM_MAX_MEMORY_FRACTION = 0.2
+
+# Scratch files reused across requests so uploads don't create and unlink a
+# file each time; created on first use, at most SCRATCH_POOL_SIZE of them.
+# Pooled by suffix so a staged file keeps its upload's extension for ffmpeg
+SCRATCH_POOL_SIZE = 16
+_scratch_pools = {suffix: queue.SimpleQueue() for suffix in ALLOWED_SUFFIXES}
+_scratch_paths: set = set()
+_scratch_lock = threading.Lock()
+
+# Whisper's input sample rate
+SAMPLE_RATE = 16000
+
+# Segments per batched ASR forward pass
+ASR_BATCH_SIZE = 16
+
+# ASR pipelines kept loaded per device; the least recently used is dropped
+# before loading another so VRAM holds at most this many
+MAX_MODELS_PER_DEVICE = 2
+
+# Loaded models shared by all requests: ASR by (model name, device) in LRU
+# order, wav2vec2 alignment by (language, device)
+_MODEL_CACHE: "OrderedDict[tuple, Any]" = OrderedDict()
+_ALIGN_CACHE: Dict[tuple, Any] = {}
+_MODEL_LOCK = threading.Lock()
+
+# One single-process worker per device runs transcriptions, keeping model
+# inference off the HTTP process's GIL and letting GPUs work in parallel
+_EXECUTORS: Dict[str, ProcessPoolExecutor] = {}
+
+# CUDA stream each worker keeps for its lifetime, by device
+_STREAMS: Dict[str, Any] = {}
+
+# GPUs visible to the server, counted at startup by gpu_count
+_GPU_COUNT: Optional[int] = None
+
+def parse_device(device: str) -> tuple:
+    """Split a device string like 'cuda:1' into ('cuda', 1); 'cpu' becomes ('cpu', 0)"""
+    device_type, _, index = device.partition(":")
+    return device_type, int(index or 0)
+
+def canonical_device(device: str) -> str:
+    """One spelling per device ('cuda:01' becomes 'cuda:1') so it maps to a single worker and model cache"""
+    device_type, device_index = parse_device(device)
+    return "cpu" if device_type == "cpu" else f"cuda:{device_index}"
+
+def cuda_device_count() -> int:
+    """Number of GPUs torch can use in this process, 0 without CUDA"""
+    import torch
+    return torch.cuda.device_count() if torch.cuda.is_available() else 0
+
+def gpu_count() -> int:
+    """GPUs on this machine, counted once in a throwaway process so the HTTP process never imports torch"""
+    global _GPU_COUNT
+    if _GPU_COUNT is None:
+        try:
+            with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context("spawn")) as probe:
+                _GPU_COUNT = probe.submit(cuda_device_count).result()
+        except Exception as e:
+            logger.warning(f"Could not count GPUs, only cpu will be accepted: {e}")
+            _GPU_COUNT = 0
+        logger.info(f"Found {_GPU_COUNT} GPUs")
+    return _GPU_COUNT
+
+def check_device(device: str, device_count: int) -> Optional[str]:
+    """Return an error message if device is malformed or not among device_count GPUs"""
+    if not DEVICE_RE.fullmatch(device):
+        return f"Invalid device '{device}', expected cuda:N or cpu"
+    device_type, device_index = parse_device(device)
+    if device_type == "cuda":
+        if device_count == 0:
+            return "CUDA not available"
+        if device_index >= device_count:
+            return f"{device} not available, only {device_count} GPUs found"
+    return None
+
+def get_compute_type(device_index: int) -> str:
+    """INT8 weights with FP16 activations on Tensor-Core GPUs (compute capability 7.0+), else plain INT8"""
+    import torch
+    major, _ = torch.cuda.get_device_capability(device_index)
+    return "int8_float16" if major >= 7 else "int8"
+
+def supports_flash_attention(device_index: int) -> bool:
+    """CTranslate2's fused flash-attention kernels need Ampere or newer (compute capability 8.0+)"""
+    import torch
+    major, _ = torch.cuda.get_device_capability(device_index)
+    return major >= 8
+
+def patch_torch_load():
+    """Default torch.load to weights_only=False (PyTorch 2.6+) so WhisperX's VAD checkpoint loads"""
+    import torch
+    if getattr(torch.load, "_weights_only_patched", False):
+        return
+    original_load = torch.load
+    def patched_load(*args, **kwargs):
+        kwargs.setdefault('weights_only', False)
+        return original_load(*args, **kwargs)
+    patched_load._weights_only_patched = True
+    torch.load = patched_load
+
+def get_model(model_name: str, device: str):
+    """Load a WhisperX batched ASR pipeline once per (name, device) and reuse it for every request"""
+    key = (model_name, device)
+    # Held while loading so concurrent requests never load the same weights twice
+    with _MODEL_LOCK:
+        asr = _MODEL_CACHE.get(key)
+        if asr is not None:
+            _MODEL_CACHE.move_to_end(key)
+        else:
+            evict_models(device, MAX_MODELS_PER_DEVICE - 1)
+            patch_torch_load()
+            import whisperx
+            device_type, device_index = parse_device(device)
+            compute_type = get_compute_type(device_index) if device_type == "cuda" else "int8"
+            logger.info(f"Loading WhisperX model {model_name} on {device} ({compute_type})...")
+            
+            # ASR attention runs inside CTranslate2, so fusion is enabled on its model
+            model_kwargs = {}
+            if device_type == "cuda" and supports_flash_attention(device_index):
+                try:
+                    from whisperx.asr import WhisperModel
+                    model_kwargs["model"] = WhisperModel(model_name, device=device_type, device_index=device_index,
+                                                         compute_type=compute_type, flash_attention=True)
+                except Exception as e:
+                    logger.warning(f"Flash attention unavailable, using standard attention: {e}")
+            
+            asr = whisperx.load_model(model_name, device_type, device_index=device_index,
+                                      compute_type=compute_type, asr_options={"beam_size": 5},
+                                      **model_kwargs)
+            _MODEL_CACHE[key] = asr
+            logger.info(f"Loaded model {model_name} on {device}")
+    return asr
+
+def evict_models(device: str, keep: int):
+    """Drop the least recently used ASR pipelines on device until at most keep remain; caller holds _MODEL_LOCK"""
+    loaded = [key for key in _MODEL_CACHE if key[1] == device]
+    if len(loaded) <= keep:
+        return
+    for key in loaded[:len(loaded) - keep]:
+        logger.info(f"Unloading model {key[0]} from {device}")
+        del _MODEL_CACHE[key]
+    if device.startswith("cuda"):
+        import gc
+        import torch
+        gc.collect()
+        torch.cuda.empty_cache()
+
+def get_align_model(language: str, device: str):
+    """Load the wav2vec2 alignment model once per (language, device)"""
+    key = (language, device)
+    with _MODEL_LOCK:
+        align_model = _ALIGN_CACHE.get(key)
+        if align_model is None:
+            import whisperx
+            logger.info(f"Loading alignment model for {language} on {device}...")
+            align_model = whisperx.load_align_model(language_code=language, device=device)
+            _ALIGN_CACHE[key] = align_model
+    return align_model
+
+def worker_device(device: str) -> str:
+    """Device name inside a worker, where CUDA_VISIBLE_DEVICES leaves only its own GPU as cuda:0"""
+    return "cpu" if device == "cpu" else "cuda:0"
+
+def init_worker(device: str):
+    """Pin a worker process to its GPU and load the default model into it"""
+    device_type, device_index = parse_device(device)
+    if device_type == "cuda":
+        # Indexes count from whatever the parent process could already see
+        visible = os.environ.get("CUDA_VISIBLE_DEVICES")
+        os.environ["CUDA_VISIBLE_DEVICES"] = visible.split(",")[device_index] if visible else str(device_index)
+    try:
+        import torch
+        # Workers only run inference, so autograd tracking is never needed
+        torch.set_grad_enabled(False)
+        warm_up(worker_device(device))
+    except Exception as e:
+        logger.warning(f"Could not preload {DEFAULT_MODEL} on {device}: {e}")
+
+def warm_up(device: str):
+    """Load the default models and run a full batch through every stage before the first request"""
+    import torch
+    import whisperx
+    from faster_whisper.tokenizer import Tokenizer
+    from whisperx.audio import N_SAMPLES, log_mel_spectrogram
+    asr = get_model(DEFAULT_MODEL, device)
+    align_model, metadata = get_align_model("en", device)
+    silence = np.zeros(SAMPLE_RATE, dtype=np.float32)
+    device_type, _ = parse_device(device)
+    with torch.inference_mode(), inference_stream(device):
+        # Only warms VAD: it finds no speech in silence, so nothing is decoded
+        asr.transcribe(silence, batch_size=ASR_BATCH_SIZE, language="en")
+        # Feed one batch of padded 30 s windows straight to the CTranslate2
+        # encoder and decoder, shaped like a real request's batches
+        n_mels = asr.model.feat_kwargs.get("feature_size") or 80
+        features = log_mel_spectrogram(silence, n_mels=n_mels, padding=N_SAMPLES - silence.shape[0])
+        tokenizer = Tokenizer(asr.model.hf_tokenizer, asr.model.model.is_multilingual,
+                              task="transcribe", language="en")
+        asr.model.generate_segment_batched(features[None].repeat(ASR_BATCH_SIZE, 1, 1).numpy(),
+                                           tokenizer, asr.options)
+        with torch.autocast(device_type, dtype=torch.float16, enabled=device_type == "cuda"):
+            whisperx.align([{"start": 0.0, "end": 1.0, "text": "warm up"}], align_model, metadata,
+                           silence, device, return_char_alignments=False)
+    logger.info(f"Warmed up {DEFAULT_MODEL} on {device}")
+
+def inference_stream(device: str):
+    """Context running work on this device's persistent CUDA stream; does nothing on CPU"""
+    if not device.startswith("cuda"):
+        return contextlib.nullcontext()
+    import torch
+    stream = _STREAMS.get(device)
+    if stream is None:
+        stream = _STREAMS[device] = torch.cuda.Stream(device=device)
+    return torch.cuda.stream(stream)
+
+def get_executor(device: str) -> ProcessPoolExecutor:
+    """Worker process for device, started on first use"""
+    executor = _EXECUTORS.get(device)
+    if executor is None:
+        executor = ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context("spawn"),
+                                       initializer=init_worker, initargs=(device,))
+        _EXECUTORS[device] = executor
+    return executor
+
+async def transcribe_in_worker(audio_path: str, language: str, model_name: str, align_mode: bool,
+                               lyrics_file: Optional[str], device: str, formats: frozenset) -> Dict[str, Any]:
+    """Run run_whisperx_script in the worker process that owns device"""
+    error = check_device(device, gpu_count())
+    if error:
+        return {"error": error}
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(get_executor(device), run_whisperx_script, audio_path,
+                                          language, model_name, align_mode, lyrics_file, worker_device(device), formats)
+    except BrokenProcessPool as e:
+        # The worker died (e.g. killed on OOM); start a fresh one next time
+        _EXECUTORS.pop(device, None)
+        return {"error": f"Transcription worker for {device} crashed: {e}"}
+
+@app.on_event("startup")
+def preload_default_model():
+    """Count GPUs and start the default device's worker at startup so the first request doesn't pay for loading"""
+    try:
+        error = check_device(DEFAULT_DEVICE, gpu_count())
+        if error is None:
+            get_executor(canonical_device(DEFAULT_DEVICE)).submit(os.getpid)
+        else:
+            logger.warning(f"Skipping model preload: {error}")
+    except Exception as e:
+        logger.warning(f"Could not preload {DEFAULT_MODEL}: {e}")
+
+@app.on_event("shutdown")
+def stop_workers():
+    """Shut down the transcription worker processes"""
+    for executor in _EXECUTORS.values():
+        executor.shutdown()
+    _EXECUTORS.clear()
 
-def run_whisperx_script(audio_path: str, language: str = "en", model: str = "large-v2",
-                       align_mode: bool = False, lyrics_file: Optional[str] = None) -> Dict[str, Any]:
-    """Run WhisperX directly and return results"""
+def load_audio(audio_path: str) -> np.ndarray:
+    """Decode to mono float32 at 16 kHz in-process, falling back to whisperx's ffmpeg pipe for formats libsndfile can't read"""
+    try:
+        import soundfile as sf
+        import resampy
+        data, sample_rate = sf.read(audio_path, dtype="float32", always_2d=False)
+    except Exception:
+        import whisperx
+        return whisperx.load_audio(audio_path)
+    
+    if data.ndim > 1:
+        data = data.mean(axis=1)
+    if sample_rate != SAMPLE_RATE:
+        data = resampy.resample(data, sample_rate, SAMPLE_RATE, filter="kaiser_fast")
+    return np.ascontiguousarray(data, dtype=np.float32)
+
+def run_whisperx_script(audio_path: str, language: str = "en", model_name: str = "large-v2",
+                       align_mode: bool = False, lyrics_file: Optional[str] = None,
+                       device: str = DEFAULT_DEVICE, formats: frozenset = ALL_FORMATS) -> Dict[str, Any]:
+    """Run WhisperX directly and return results in the requested formats"""
 
     try:
         import torch
-        import whisper
+        import whisperx
     except ImportError as e:
         return {"error": f"Failed to import required packages: {e}"}
 
-    logger.info(f"Processing audio file: {audio_path} with language: {language}, model: {model}")
+    logger.info(f"Processing audio file: {audio_path} with language: {language}, model: {model_name}")
 
     try:
-        # Use GPU 1 (RTX 3090)
-        device = "cuda:1"
         logger.info(f"Using device: {device}")
         
-        # Check CUDA availability
-        if not torch.cuda.is_available():
-            return {"error": "CUDA not available"}
+        # Check the requested device exists
+        error = check_device(device, cuda_device_count())
+        if error:
+            return {"error": error}
+        device_type, _ = parse_device(device)
         
-        if torch.cuda.device_count() < 2:
-            return {"error": f"GPU 1 not available, only {torch.cuda.device_count()} GPUs found"}
+        # Batched WhisperX pipeline, cached after the first request
+        asr = get_model(model_name, device)
         
-        # Use basic whisper model
-        logger.info("Loading Whisper model...")
-        model = whisper.load_model(model, device=device)
-        logger.info("Model loaded successfully")
-        
-        # Transcribe
-        logger.info("Starting transcription...")
-        result = model.transcribe(audio_path, language=language)
-        logger.info("Transcription completed")
-        
-        # Convert to desired format
-        transcription = result["text"]
-        srt_content = ""
-        vtt_content = "WEBVTT\n\n"
-        json_data = result
-        
-        segment_id = 1
-        for segment in result["segments"]:
-            start_time = segment["start"]
-            end_time = segment["end"]
-            text = segment["text"]
+        audio = load_audio(audio_path)
+        with torch.inference_mode(), inference_stream(device):
+            # Transcribe: VAD splits the audio into chunks that are decoded in batches
+            logger.info("Starting transcription...")
+            result = asr.transcribe(audio, batch_size=ASR_BATCH_SIZE, language=language)
+            logger.info("Transcription completed")
             
-            # SRT format
-            srt_content += f"{segment_id}\n"
-            srt_content += f"{format_timestamp(start_time)} --> {format_timestamp(end_time)}\n"
-            srt_content += f"{text}\n\n"
-            
-            # VTT format
-            vtt_content += f"{format_timestamp_vtt(start_time)} --> {format_timestamp_vtt(end_time)}\n"
-            vtt_content += f"{text}\n\n"
-            
-            segment_id += 1
+            # Word-level timestamps from wav2vec2 forced alignment
+            segments = result["segments"]
+            try:
+                align_model, metadata = get_align_model(result["language"], device)
+                # FP16 activations let wav2vec2's attention dispatch to the fused SDPA kernels
+                with torch.autocast(device_type, dtype=torch.float16, enabled=device_type == "cuda"):
+                    segments = whisperx.align(segments, align_model, metadata, audio, device,
+                                              return_char_alignments=False)["segments"]
+            except Exception as e:
+                logger.warning(f"Alignment unavailable for {result['language']}, returning segment timestamps only: {e}")
+        fill_missing_timestamps(segments)
+        
+        # Build only the formats the caller asked for; the plain text is joined
+        # straight from the segments and skipped when only subtitles are wanted.
+        # Aligned segments are punkt sentences without leading spaces, so join
+        # with a separator rather than relying on Whisper's leading space
+        output = {}
+        if formats & {"txt", "json"}:
+            transcription = " ".join(segment["text"].strip() for segment in segments)
+        if "txt" in formats:
+            output["transcription"] = transcription.strip()
+        if formats & {"srt", "vtt"}:
+            # Format every start/end in one vectorized pass shared by SRT and VTT
+            times = np.fromiter((segment[key] for key in ("start", "end") for segment in segments),
+                                dtype=np.float64, count=2 * len(segments))
+            srt_times = format_timestamps(times)
+            if "srt" in formats:
+                output["srt"] = build_srt(segments, srt_times)
+            if "vtt" in formats:
+                output["vtt"] = build_vtt(segments, [timestamp.replace(",", ".") for timestamp in srt_times])
+        if "json" in formats:
+            output["json_data"] = {"text": transcription, "segments": segments, "language": result["language"]}
         
-        return {
-            "transcription": transcription.strip(),
-            "srt": srt_content.strip(),
-            "vtt": vtt_content.strip(),
-            "json_data": json_data
-        }
+        return output
 
     except Exception as e:
         logger.error(f"Error running Whisper: {str(e)}")
         return {"error": str(e)}
 
-def format_timestamp(seconds: float) -> str:
-    """Format seconds to SRT timestamp format (HH:MM:SS,mmm)"""
-    hours = int(seconds // 3600)
-    minutes = int((seconds % 3600) // 60)
-    secs = int(seconds % 60)
-    millis = int((seconds % 1) * 1000)
-    return f"{hours:02d}:{minutes:02d}:{secs:02d},{millis:03d}"
-
-def format_timestamp_vtt(seconds: float) -> str:
-    """Format seconds to VTT timestamp format (HH:MM:SS.mmm)"""
-    hours = int(seconds // 3600)
-    minutes = int((seconds % 3600) // 60)
-    secs = int(seconds % 60)
-    millis = int((seconds % 1) * 1000)
-    return f"{hours:02d}:{minutes:02d}:{secs:02d}.{millis:03d}"
-
-def process_transcription(job_id: str, audio_path: str, language: str, model: str,
-                        align_mode: bool, lyrics_file: Optional[str]):
+def is_time(value) -> bool:
+    """True for a finite number; alignment leaves None or NaN where it found no match"""
+    try:
+        return value is not None and math.isfinite(value)
+    except TypeError:
+        return False
+
+def fill_missing_timestamps(segments: list):
+    """Fill the times whisperx.align leaves missing or NaN for unalignable words (digits, symbols) in place"""
+    # Clients read these as plain numbers: a missing start takes the previous
+    # word's end, a missing end the next aligned start, else the segment bounds
+    previous_end = 0.0
+    for segment in segments:
+        words = segment.get("words") or []
+        if not is_time(segment.get("start")):
+            segment["start"] = next((word["start"] for word in words if is_time(word.get("start"))), previous_end)
+        if not is_time(segment.get("end")):
+            segment["end"] = next((word["end"] for word in reversed(words) if is_time(word.get("end"))),
+                                  segment["start"])
+        cursor = segment["start"]
+        for index, word in enumerate(words):
+            if not is_time(word.get("start")):
+                word["start"] = cursor
+            if not is_time(word.get("end")):
+                word["end"] = max(word["start"], next((later["start"] for later in words[index + 1:]
+                                                       if is_time(later.get("start"))), segment["end"]))
+            if not is_time(word.get("score")):
+                word["score"] = 0.0
+            cursor = word["end"]
+        previous_end = segment["end"]
+
+def build_srt(segments: list, timestamps: list) -> str:
+    """SRT cues for segments, given every start timestamp followed by every end timestamp"""
+    count = len(segments)
+    # Collect blocks and join once; += would copy the whole string per segment
+    parts = [f"{segment_id}\n{timestamps[segment_id - 1]} --> {timestamps[count + segment_id - 1]}\n{segment['text']}\n"
+             for segment_id, segment in enumerate(segments, 1)]
+    return "\n".join(parts).strip()
+
+def build_vtt(segments: list, timestamps: list) -> str:
+    """WebVTT cues for segments, timestamps laid out as for build_srt"""
+    count = len(segments)
+    parts = [f"{timestamps[index]} --> {timestamps[count + index]}\n{segment['text']}\n"
+             for index, segment in enumerate(segments)]
+    return "\n".join(["WEBVTT\n", *parts]).strip()
+
+def format_timestamps(seconds: np.ndarray) -> list:
+    """Format an array of seconds to SRT timestamps (HH:MM:SS,mmm); VTT differs only by '.' before the millis"""
+    hours = (seconds // 3600).astype(np.int64).tolist()
+    minutes = ((seconds % 3600) // 60).astype(np.int64).tolist()
+    secs = (seconds % 60).astype(np.int64).tolist()
+    millis = ((seconds % 1) * 1000).astype(np.int64).tolist()
+    return [f"{h:02d}:{m:02d}:{s:02d},{ms:03d}" for h, m, s, ms in zip(hours, minutes, secs, millis)]
+
+def upload_dir(size: Optional[int]) -> Optional[str]:
+    """Pick /dev/shm for uploads that comfortably fit in memory, else the default temp dir"""
+    if SHM_DIR is None or size is None:
+        return None
+    if size > psutil.virtual_memory().available * SHM_MAX_MEMORY_FRACTION:
+        return None
+    return SHM_DIR
+
+def acquire_scratch(size: Optional[int], suffix: str) -> str:
+    """Hand out a pooled scratch file, or a one-off temp file when the upload doesn't fit in /dev/shm"""
+    directory = upload_dir(size)
+    if directory == SHM_DIR:
+        try:
+            return _scratch_pools[suffix].get_nowait()
+        except queue.Empty:
+            pass
+    fd, path = tempfile.mkstemp(prefix="whisperx_", suffix=suffix, dir=directory)
+    os.close(fd)
+    if directory == SHM_DIR:
+        with _scratch_lock:
+            if len(_scratch_paths) < SCRATCH_POOL_SIZE:
+                _scratch_paths.add(path)
+    return path
+
+def release_scratch(path: str):
+    """Empty a pooled scratch file and return it to the pool; one-off files are deleted"""
+    if path in _scratch_paths:
+        os.truncate(path, 0)
+        _scratch_pools[os.path.splitext(path)[1]].put(path)
+    else:
+        os.unlink(path)
+
+@app.on_event("shutdown")
+def remove_scratch_files():
+    """Delete pooled scratch files so they don't linger in /dev/shm"""
+    with _scratch_lock:
+        for path in _scratch_paths:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        _scratch_paths.clear()
+
+async def save_upload(upload: UploadFile, suffix: str) -> str:
+    """Copy an upload to a scratch file in 1 MiB chunks without blocking the event loop"""
+    path = acquire_scratch(upload.size, suffix)
+    try:
+        async with aiofiles.open(path, "wb") as f:
+            while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+                await f.write(chunk)
+    except BaseException:
+        release_scratch(path)
+        raise
+    return path
+
+def parse_formats(formats: str) -> frozenset:
+    """Turn a comma-separated formats parameter into a set, rejecting unknown names"""
+    requested = frozenset(name.strip().lower() for name in formats.split(",") if name.strip())
+    unknown = requested - ALL_FORMATS
+    if unknown or not requested:
+        raise HTTPException(status_code=400, detail="Invalid formats. Use a comma-separated list of txt, srt, vtt, json")
+    return requested
+
+def normalize_device(device: str) -> str:
+    """Validate a device parameter and return its canonical spelling, used for everything after"""
+    if not DEVICE_RE.fullmatch(device):
+        raise HTTPException(status_code=400, detail="Invalid device. Use cuda:N or cpu")
+    return canonical_device(device)
+
+def iter_result_json(result: Dict[str, Any]):
+    """Encode a result as JSON piece by piece, streaming json_data's segments in chunks"""
+    yield b"{"
+    for index, (key, value) in enumerate(result.items()):
+        yield (b"," if index else b"") + orjson.dumps(key) + b":"
+        if key == "json_data":
+            yield from iter_result_json(value)
+        elif key == "segments":
+            yield b"["
+            for start in range(0, len(value), STREAM_SEGMENTS_PER_CHUNK):
+                chunk = orjson.dumps(value[start:start + STREAM_SEGMENTS_PER_CHUNK], option=orjson.OPT_SERIALIZE_NUMPY)
+                yield (b"," if start else b"") + chunk[1:-1]
+            yield b"]"
+        else:
+            yield orjson.dumps(value, option=orjson.OPT_SERIALIZE_NUMPY)
+    yield b"}"
+
+async def stage_upload(file: UploadFile, lyrics: Optional[str], align_mode: bool, model: str) -> tuple:
+    """Validate an upload and stage it, plus lyrics in align mode, on disk; returns (audio_path, lyrics_path)"""
+    suffix = Path(file.filename).suffix.lower()
+    if suffix not in ALLOWED_SUFFIXES:
+        raise HTTPException(status_code=400, detail="Unsupported file type. Use WAV, MP3, M4A, FLAC, or OGG")
+    if model not in ALLOWED_MODELS:
+        raise HTTPException(status_code=400, detail=f"Unknown model. Use one of {', '.join(sorted(ALLOWED_MODELS))}")
+    
+    audio_path = await save_upload(file, suffix)
+    lyrics_path = None
+    if lyrics and align_mode:
+        try:
+            with tempfile.NamedTemporaryFile(delete=False, suffix='.txt', mode='w', dir=SHM_DIR) as lyrics_file:
+                lyrics_file.write(lyrics)
+                lyrics_path = lyrics_file.name
+        except BaseException:
+            release_scratch(audio_path)
+            raise
+    return audio_path, lyrics_path
+
+def cleanup_upload(audio_path: str, lyrics_path: Optional[str]):
+    """Release the staged audio file and delete the lyrics file"""
+    try:
+        release_scratch(audio_path)
+    except OSError:
+        pass
+    if lyrics_path:
+        try:
+            os.unlink(lyrics_path)
+        except OSError:
+            pass
+
+@contextlib.asynccontextmanager
+async def staged_upload(file: UploadFile, lyrics: Optional[str], align_mode: bool, model: str):
+    """Stage an upload for the duration of the block"""
+    audio_path, lyrics_path = await stage_upload(file, lyrics, align_mode, model)
+    try:
+        yield audio_path, lyrics_path
+    finally:
+        cleanup_upload(audio_path, lyrics_path)
+
+def finish_job(job_id: str, job: Dict[str, Any]):
+    """Move a job out of active_jobs into the expiring jobs cache"""
+    with jobs_lock:
+        active_jobs.pop(job_id, None)
+        jobs[job_id] = job
+
+async def process_transcription(job_id: str, audio_path: str, language: str, model_name: str,
+                                align_mode: bool, lyrics_file: Optional[str], device: str, formats: frozenset):
     """Background task to process transcription"""
     try:
-        result = run_whisperx_script(audio_path, language, model, align_mode, lyrics_file)
-        jobs[job_id] = {"status": "completed", "result": result}
+        result = await transcribe_in_worker(audio_path, language, model_name, align_mode, lyrics_file, device, formats)
+        finish_job(job_id, {"status": "completed", "result": result})
     except Exception as e:
-        jobs[job_id] = {"status": "failed", "error": str(e)}
+        finish_job(job_id, {"status": "failed", "error": str(e)})
     finally:
-        # Cleanup temporary files
-        try:
-            os.unlink(audio_path)
-            if lyrics_file:
-                os.unlink(lyrics_file)
-        except:
-            pass
+        cleanup_upload(audio_path, lyrics_file)
 
 @app.post("/transcribe", response_model=TranscriptionResponse)
 async def transcribe_audio(
@@ -155,34 +649,27 @@ async def transcribe_audio(
     language: str = "en",
     model: str = "large-v2",
     align_mode: bool = False,
-    lyrics: Optional[str] = None
+    lyrics: Optional[str] = None,
+    device: str = DEFAULT_DEVICE,
+    formats: str = "txt,srt,vtt,json"
 ):
     """Upload audio file and start transcription"""
 
-    # Validate file type
-    if not file.filename.lower().endswith(('.wav', '.mp3', '.m4a', '.flac', '.ogg')):
-        raise HTTPException(status_code=400, detail="Unsupported file type. Use WAV, MP3, M4A, FLAC, or OGG")
+    requested_formats = parse_formats(formats)
+    device = normalize_device(device)
 
-    # Save uploaded file temporarily
-    with tempfile.NamedTemporaryFile(delete=False, suffix=Path(file.filename).suffix) as temp_file:
-        shutil.copyfileobj(file.file, temp_file)
-        audio_path = temp_file.name
-
-    # Save lyrics if provided
-    lyrics_path = None
-    if lyrics and align_mode:
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.txt', mode='w') as lyrics_file:
-            lyrics_file.write(lyrics)
-            lyrics_path = lyrics_file.name
+    # Staged files are released by the background task once it finishes
+    audio_path, lyrics_path = await stage_upload(file, lyrics, align_mode, model)
 
     # Generate job ID
-    job_id = f"job_{len(jobs) + 1}"
+    job_id = uuid.uuid4().hex
 
     # Start background processing
-    jobs[job_id] = {"status": "processing"}
+    with jobs_lock:
+        active_jobs[job_id] = {"status": "processing"}
     background_tasks.add_task(
         process_transcription,
-        job_id, audio_path, language, model, align_mode, lyrics_path
+        job_id, audio_path, language, model, align_mode, lyrics_path, device, requested_formats
     )
 
     return TranscriptionResponse(
@@ -194,11 +681,14 @@ async def transcribe_audio(
 @app.get("/status/{job_id}", response_model=TranscriptionStatus)
 async def get_transcription_status(job_id: str):
     """Get transcription job status"""
-    if job_id not in jobs:
+    with jobs_lock:
+        job = active_jobs.get(job_id) or jobs.get(job_id)
+    if job is None:
         raise HTTPException(status_code=404, detail="Job not found")
 
-    job = jobs[job_id]
-    return TranscriptionStatus(**job)
+    # Returned as a response so pydantic doesn't re-serialize the result, which
+    # rejects numpy values that orjson encodes; response_model stays for the docs
+    return ORJSONResponse({"status": job["status"], "result": job.get("result"), "error": job.get("error")})
 
 @app.post("/transcribe/sync")
 async def transcribe_audio_sync(
@@ -206,42 +696,25 @@ async def transcribe_audio_sync(
     language: str = "en",
     model: str = "large-v2",
     align_mode: bool = False,
-    lyrics: Optional[str] = None
+    lyrics: Optional[str] = None,
+    device: str = DEFAULT_DEVICE,
+    formats: str = "txt,srt,vtt,json"
 ):
     """Synchronous transcription (not recommended for large files)"""
 
-    # Validate file type
-    if not file.filename.lower().endswith(('.wav', '.mp3', '.m4a', '.flac', '.ogg')):
-        raise HTTPException(status_code=400, detail="Unsupported file type")
-
-    # Save uploaded file temporarily
-    with tempfile.NamedTemporaryFile(delete=False, suffix=Path(file.filename).suffix) as temp_file:
-        shutil.copyfileobj(file.file, temp_file)
-        audio_path = temp_file.name
-
-    # Save lyrics if provided
-    lyrics_path = None
-    if lyrics and align_mode:
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.txt', mode='w') as lyrics_file:
-            lyrics_file.write(lyrics)
-            lyrics_path = lyrics_file.name
-
-    try:
-        result = run_whisperx_script(audio_path, language, model, align_mode, lyrics_path)
+    requested_formats = parse_formats(formats)
+    device = normalize_device(device)
 
-        if "error" in result:
-            raise HTTPException(status_code=500, detail=result["error"])
+    async with staged_upload(file, lyrics, align_mode, model) as (audio_path, lyrics_path):
+        result = await transcribe_in_worker(audio_path, language, model, align_mode, lyrics_path,
+                                            device, requested_formats)
 
-        return result
+    if "error" in result:
+        raise HTTPException(status_code=500, detail=result["error"])
 
-    finally:
-        # Cleanup
-        try:
-            os.unlink(audio_path)
-            if lyrics_path:
-                os.unlink(lyrics_path)
-        except:
-            pass
+    # Streamed so long transcripts are never encoded into one big buffer; orjson
+    # also takes numpy values that FastAPI's jsonable_encoder would reject
+    return StreamingResponse(iter_result_json(result), media_type="application/json")
 
 @app.get("/health")
 async def health_check():
@@ -249,4 +722,6 @@ async def health_check():
     return {"status": "healthy", "service": "WhisperX API"}
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8181)
\ No newline at end of file
+    # One HTTP process: jobs live in its memory and it owns the per-GPU
+    # transcription workers, so extra uvicorn workers would duplicate both
+    uvicorn.run(app, host="0.0.0.0", port=8181, loop="uvloop", http="httptools", backlog=2048)
\ No newline at end of file